@@ -0,0 +1,128 @@
+"""
+Dynamic Micro-Batching Inference Engine
+Collects preprocessed tensors from concurrent requests and runs them
+through the model as one batch
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import executor
+import metrics
+
+# Flush a batch once it holds this many images...
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+# ...or once the oldest queued image has waited this long
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+
+class BatchInferenceEngine:
+    """Queues single-image tensors and answers each caller with its own softmax row"""
+
+    def __init__(self, model, device, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 channels_last=False):
+        self.model = model
+        self.device = device
+        self.channels_last = channels_last
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = None
+        self._worker = None
+        # One forward pass at a time; the event loop keeps collecting the next batch meanwhile
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-forward")
+
+        self.batch_sizes = Counter()
+        self.total_requests = 0
+
+    async def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=True)
+
+    async def predict(self, tensor):
+        """Submit one CHW tensor and wait for its softmax probabilities (1-D tensor)"""
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future, time.perf_counter()))
+        return await future
+
+    def _forward_batch(self, tensors):
+        batch = torch.stack(tensors).to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad():
+            outputs = self.model(batch)
+            return torch.nn.functional.softmax(outputs, dim=1).cpu()
+
+    def _forward(self, tensors):
+        with metrics.stage("forward"):
+            return self._forward_batch(tensors)
+
+    async def warm_up(self, batch_sizes, rounds):
+        """Dummy forward passes on the forward thread, kept out of the batch stats and metrics"""
+        loop = asyncio.get_running_loop()
+        for _ in range(rounds):
+            for size in batch_sizes:
+                dummy = [torch.zeros(3, 224, 224) for _ in range(size)]
+                await loop.run_in_executor(self._executor, self._forward_batch, dummy)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await executor.collect_batch(self._queue, self.max_batch_size, self.max_wait)
+            # Drop callers that gave up (e.g. client disconnected) before spending compute on them
+            items = [item for item in items if not item[1].done()]
+            if not items:
+                continue
+
+            self.batch_sizes[len(items)] += 1
+            self.total_requests += len(items)
+            metrics.observe_batch(len(items))
+            # Queueing delay each request paid waiting for its batch to form
+            now = time.perf_counter()
+            for _, _, enqueued_at in items:
+                metrics.observe_stage("batch_wait", now - enqueued_at)
+
+            try:
+                probabilities = await loop.run_in_executor(
+                    self._executor, self._forward, [t for t, _, _ in items]
+                )
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for row, (_, future, _) in zip(probabilities, items):
+                if not future.done():
+                    future.set_result(row)
+
+    def stats(self):
+        """Batch-size distribution for tuning throughput against tail latency"""
+        total_batches = sum(self.batch_sizes.values())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "total_batches": total_batches,
+            "total_requests": self.total_requests,
+            "mean_batch_size": round(self.total_requests / total_batches, 2) if total_batches else 0.0,
+            "batch_size_distribution": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,359 @@
+"""
+Offline Bulk Scoring
+Scores directories of field/drone images with the serving model and bulk-inserts the
+results into scan_logs, without going through the HTTP API
+
+Usage:
+    python bulk_score.py /data/drone_2024 /data/field_photos
+    python bulk_score.py /data/drone_2024 --manifest drone_2024.jsonl   # resume after a crash
+    python bulk_score.py /data/drone_2024 --no-db                       # manifest only
+
+Streaming pipeline, each stage a generator pulling from the previous one:
+    walk (thread pool) -> decode + resize (process pool) -> batched forward -> bulk insert
+Only a bounded number of images is in flight at any point, whatever the archive size.
+Each flush commits its rows and then appends every scored path to the manifest, so a
+rerun skips finished images; a crash between the two can repeat at most one flush.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from main import CLASSES_PATH, IMAGE_EXTENSIONS, MODEL_PATH
+
+# Files per process-pool task: large enough to amortize pickling, small enough to keep workers busy
+DECODE_CHUNK = 16
+
+
+def cpu_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# -------------------- PIPELINE STAGES --------------------
+
+def scan_directory(directory):
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(entry.path)
+    except OSError as e:
+        print(f"⚠️ Skipping {directory}: {e}")
+    return sorted(files), subdirs
+
+
+def walk_images(roots, workers):
+    """Yield every image path under roots, listing directories in parallel"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walk") as pool:
+        pending = set()
+        for root in roots:
+            root = os.path.abspath(root)
+            if os.path.isfile(root):
+                yield root
+            else:
+                pending.add(pool.submit(scan_directory, root))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                pending.update(pool.submit(scan_directory, subdir) for subdir in subdirs)
+                yield from files
+
+
+def skip_done(paths, done, progress):
+    for path in paths:
+        if path in done:
+            progress.skipped += 1
+        else:
+            yield path
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decode_chunk(paths, max_pixels):
+    """Process-pool task: [(path, mtime, HWC uint8 array or None, error or None)]"""
+    import preprocess
+
+    decoded = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                image = preprocess.decode(f, max_pixels=max_pixels)
+                array = preprocess.resize_array(image)
+            decoded.append((path, os.path.getmtime(path), array, None))
+        except Exception as e:
+            decoded.append((path, None, None, f"{type(e).__name__}: {e}"))
+    return decoded
+
+
+def decode_all(chunks, pool, max_pixels, max_in_flight, progress):
+    """Keep at most max_in_flight chunks queued on the pool; yield decoded images in walk order"""
+    in_flight = deque()
+    for chunk in chunks:
+        in_flight.append(pool.submit(decode_chunk, chunk, max_pixels))
+        if len(in_flight) >= max_in_flight:
+            with progress.timer("decode_wait"):
+                ready = in_flight.popleft().result()
+            yield from ready
+    while in_flight:
+        with progress.timer("decode_wait"):
+            ready = in_flight.popleft().result()
+        yield from ready
+
+
+def score_batches(items, serving, batch_size, progress):
+    """Yield (path, mtime, (disease_name, confidence, remedy) or None, error or None)"""
+    import preprocess
+
+    def run(batch):
+        with progress.timer("forward"):
+            labels = serving.predict_batch(preprocess.normalize([array for _, _, array in batch]))
+        for (path, mtime, _), label in zip(batch, labels):
+            yield path, mtime, label, None
+
+    batch = []
+    for path, mtime, array, error in items:
+        if error is not None:
+            yield path, mtime, None, error
+            continue
+        batch.append((path, mtime, array))
+        if len(batch) == batch_size:
+            yield from run(batch)
+            batch = []
+    if batch:
+        yield from run(batch)
+
+
+# -------------------- MANIFEST AND DATABASE --------------------
+
+def load_manifest(path):
+    """Paths already scored (or failed) by earlier runs"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    complete = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Torn last line from a crash mid-append
+            complete += len(line)
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError):
+                continue
+    # Cut the torn tail off, so the next append starts on a fresh line
+    if complete != os.path.getsize(path):
+        os.truncate(path, complete)
+    return done
+
+
+class ResultWriter:
+    """Buffers results; each flush bulk-inserts the rows, then checkpoints the manifest"""
+
+    def __init__(self, manifest_path, flush_size, use_db, file_timestamps, progress, model_version=None):
+        self.manifest_path = manifest_path
+        self.flush_size = max(1, flush_size)
+        self.use_db = use_db
+        self.file_timestamps = file_timestamps
+        self.progress = progress
+        self.model_version = model_version
+        self._pending = []
+        # One loop for the whole run, so the async engine's pooled connections stay usable
+        self._loop = asyncio.new_event_loop() if use_db else None
+
+    def add(self, path, mtime, label, error):
+        self._pending.append((path, mtime, label, error))
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        import scan_writer
+
+        rows, lines = [], []
+        for path, mtime, label, error in self._pending:
+            if error is not None:
+                lines.append({"path": path, "error": error})
+                continue
+            disease_name, confidence, remedy = label
+            row = scan_writer.scan_log_row(disease_name, confidence, remedy, self.model_version)
+            if self.file_timestamps and mtime is not None:
+                row["timestamp"] = datetime.datetime.utcfromtimestamp(mtime)
+            rows.append(row)
+            lines.append({"path": path, "disease_name": disease_name, "confidence": confidence,
+                          "model_version": self.model_version})
+
+        if self.use_db and rows:
+            with self.progress.timer("db"):
+                # Same insert + rollup transaction as the API's write path
+                self._loop.run_until_complete(scan_writer.save_scan_logs(rows))
+
+        with open(self.manifest_path, 'a') as f:
+            f.write("".join(json.dumps(line) + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.progress.scored += len(rows)
+        self.progress.errors += len(lines) - len(rows)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._loop is not None:
+            import database
+
+            self._loop.run_until_complete(database.async_engine.dispose())
+            self._loop.close()
+
+
+# -------------------- PROGRESS --------------------
+
+class _Timer:
+    __slots__ = ("progress", "name", "start")
+
+    def __init__(self, progress, name):
+        self.progress = progress
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.progress.seconds[self.name] = self.progress.seconds.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class Progress:
+    def __init__(self, report_every):
+        self.report_every = report_every
+        self.scored = 0
+        self.errors = 0
+        self.skipped = 0
+        self.seconds = {}
+        self.started = time.perf_counter()
+        self._last_report = (self.started, 0)
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def _breakdown(self, elapsed):
+        return ", ".join(f"{name} {100 * seconds / elapsed:.0f}%" for name, seconds in sorted(self.seconds.items()))
+
+    def maybe_report(self):
+        now = time.perf_counter()
+        last_time, last_done = self._last_report
+        if now - last_time < self.report_every:
+            return
+        done = self.scored + self.errors
+        elapsed = now - self.started
+        print(f"   {self.scored:,} scored, {self.errors:,} errors, {self.skipped:,} skipped | "
+              f"{done / elapsed:.1f} img/s (last {now - last_time:.0f}s: {(done - last_done) / (now - last_time):.1f}) | "
+              f"{self._breakdown(elapsed)}")
+        self._last_report = (now, done)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        done = self.scored + self.errors
+        return {
+            "scored": self.scored,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 1),
+            "images_per_sec": round(done / elapsed, 1) if elapsed else 0.0,
+            "seconds": {name: round(seconds, 1) for name, seconds in self.seconds.items()},
+        }
+
+
+# -------------------- MAIN --------------------
+
+def run(args):
+    import database
+    import main
+    import model_runtime
+    import preprocess  # Imported before the fork, so workers share torch's pages instead of importing it again
+    import uploads
+
+    decode_workers = args.workers or max(1, cpu_cores() // 2)
+    torch_threads = args.threads or max(1, cpu_cores() - decode_workers)
+
+    # Forked before the model exists and before torch starts its thread pool
+    pool = ProcessPoolExecutor(max_workers=decode_workers)
+    pool.submit(os.getpid).result()
+
+    if not args.no_db:
+        main.setup_database()
+        database.engine.dispose()
+
+    state = model_runtime.StartupState()
+    serving = model_runtime.load_serving_model(args.model, args.classes, state)
+    import torch
+    torch.set_num_threads(torch_threads)  # Overrides the serving default set by load_serving_model
+    print(f"✅ Model loaded ({serving.backend}, {len(serving.class_names)} classes, version {serving.version}); "
+          f"{decode_workers} decode processes, {torch_threads} torch threads, batches of {args.batch_size}")
+
+    done = load_manifest(args.manifest)
+    if done:
+        print(f"Resuming: {len(done):,} images already in {args.manifest}")
+
+    progress = Progress(args.report_every)
+    writer = ResultWriter(args.manifest, args.flush_size, not args.no_db, args.timestamps == "file", progress,
+                          model_version=serving.version)
+    try:
+        paths = skip_done(walk_images(args.roots, args.walk_workers), done, progress)
+        decoded = decode_all(chunked(paths, DECODE_CHUNK), pool, uploads.MAX_IMAGE_PIXELS,
+                             max_in_flight=2 * decode_workers, progress=progress)
+        for result in score_batches(decoded, serving, args.batch_size, progress):
+            writer.add(*result)
+            progress.maybe_report()
+    finally:
+        writer.close()
+        pool.shutdown(cancel_futures=True)
+
+    summary = progress.summary()
+    print(f"✅ Done: {summary['scored']:,} scored, {summary['errors']:,} errors, {summary['skipped']:,} skipped "
+          f"in {summary['elapsed_s']}s ({summary['images_per_sec']} img/s)")
+    print(f"   time: {json.dumps(summary['seconds'])}")
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score image directories offline and load the results into scan_logs")
+    parser.add_argument("roots", nargs="+", help="Directories (searched recursively) or image files")
+    parser.add_argument("--manifest", default="bulk_manifest.jsonl", help="Checkpoint of scored paths; reruns skip them")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per forward pass")
+    parser.add_argument("--workers", type=int, help="Decode processes (default: half the cores)")
+    parser.add_argument("--threads", type=int, help="Torch threads (default: the remaining cores)")
+    parser.add_argument("--walk-workers", type=int, default=8, help="Threads listing directories")
+    parser.add_argument("--flush-size", type=int, default=1000, help="Rows per bulk insert and manifest checkpoint")
+    parser.add_argument("--timestamps", choices=("now", "file"), default="now",
+                        help="scan_logs timestamp: scoring time, or the image file's mtime")
+    parser.add_argument("--report-every", type=float, default=10, help="Seconds between progress lines")
+    parser.add_argument("--no-db", action="store_true", help="Only write the manifest")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--classes", default=CLASSES_PATH)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,138 @@
+"""
+Training Sample Index
+Caches the (image_path, class_id) list built from the YOLO label files, so training
+runs skip re-listing the dataset and re-reading one .txt file per image
+
+Each directory's entry is reused while its fingerprint still matches:
+    mtime   directory mtime - catches added, removed and renamed files (default)
+    hash    SHA-256 over every label file's name, size and mtime - also catches labels edited
+            in place, for one stat() per file instead of one open() + read()
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_VALIDATION = os.getenv("SAMPLE_INDEX_VALIDATION", "mtime")
+INDEX_WORKERS = int(os.getenv("SAMPLE_INDEX_WORKERS", str(min(32, (os.cpu_count() or 1) * 4))))
+INDEX_VERSION = 1
+
+# Label files handled per scanner task
+_CHUNK_SIZE = 512
+
+
+def _read_labels(txt_paths):
+    """[(txt_path, bytes)] for one chunk of label files"""
+    contents = []
+    for txt_path in txt_paths:
+        with open(txt_path, 'rb') as f:
+            contents.append((txt_path, f.read()))
+    return contents
+
+
+def _chunks(items, size=_CHUNK_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _parse_label(content):
+    """Class id from the first number of a YOLO label file, None for empty files"""
+    content = content.decode().strip()
+    if not content:
+        return None
+    return int(content.split()[0])
+
+
+def _label_pairs(data_dir):
+    """Sorted (jpg_path, txt_path) pairs from a single directory listing"""
+    names = set(os.listdir(data_dir))
+    pairs = []
+    for name in sorted(names):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() == ".jpg" and stem + ".txt" in names:
+            pairs.append((os.path.join(data_dir, name), os.path.join(data_dir, stem + ".txt")))
+    return pairs
+
+
+def _stat_labels(txt_paths):
+    return [(os.path.basename(p), os.stat(p)) for p in txt_paths]
+
+
+def _fingerprint(pairs, pool):
+    """Hash of every label file's name, size and mtime"""
+    digest = hashlib.sha256()
+    for chunk in pool.map(_stat_labels, _chunks([txt for _, txt in pairs])):
+        for name, stat in chunk:
+            digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return digest.hexdigest()
+
+
+def _scan_dir(pairs, pool):
+    """Read every label file in parallel"""
+    samples = []
+    by_txt = dict((txt, jpg) for jpg, txt in pairs)
+    for chunk in pool.map(_read_labels, _chunks([txt for _, txt in pairs])):
+        for txt_path, content in chunk:
+            class_id = _parse_label(content)
+            if class_id is not None:
+                samples.append((by_txt[txt_path], class_id))
+    return samples
+
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        print(f"⚠️ Unreadable sample index {index_path} - rebuilding")
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index.get("dirs", {})
+
+
+def save_index(index_path, dirs):
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": INDEX_VERSION, "dirs": dirs}, f)
+    os.replace(tmp_path, index_path)
+
+
+def indexed_samples(data_dirs, index_path, validation=INDEX_VALIDATION, workers=INDEX_WORKERS):
+    """(image_path, class_id) for every labelled jpg in data_dirs, rescanning only stale directories"""
+    if validation not in ("mtime", "hash"):
+        raise ValueError(f"SAMPLE_INDEX_VALIDATION must be 'mtime' or 'hash', got {validation!r}")
+
+    dirs = load_index(index_path)
+    samples = []
+    rescanned = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for data_dir in data_dirs:
+            if not os.path.isdir(data_dir):
+                print(f"Warning: Directory not found: {data_dir}")
+                continue
+
+            entry = dirs.get(data_dir)
+            mtime_ns = os.stat(data_dir).st_mtime_ns
+            if validation == "mtime" and entry is not None and entry["mtime_ns"] == mtime_ns:
+                samples.extend(map(tuple, entry["samples"]))
+                continue
+
+            pairs = _label_pairs(data_dir)
+            fingerprint = _fingerprint(pairs, pool) if validation == "hash" else None
+            if validation == "hash" and entry is not None and entry.get("hash") == fingerprint:
+                samples.extend(map(tuple, entry["samples"]))
+                continue
+
+            dir_samples = _scan_dir(pairs, pool)
+            dirs[data_dir] = {"mtime_ns": mtime_ns, "hash": fingerprint, "samples": dir_samples}
+            samples.extend(dir_samples)
+            rescanned += 1
+
+    if rescanned:
+        save_index(index_path, dirs)
+    print(f"Sample index: {len(samples)} samples, {rescanned}/{len(data_dirs)} directories rescanned")
+    return samples
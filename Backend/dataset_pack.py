@@ -0,0 +1,162 @@
+"""
+Packed Training Dataset
+Decodes and resizes every training image once into a contiguous uint8 array on disk,
+so epochs read samples through a NumPy memmap and only pay for augmentation
+
+Layout of a pack directory:
+    images.u8       raw (N, size, size, 3) uint8 array, appended to as new images arrive
+    labels.npy      (N,) int64 class ids
+    active.npy      row indices still backed by a source image
+    manifest.json   source path, mtime, byte size, label and row of every sample
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+PACK_WORKERS = int(os.getenv("PACK_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _paths(pack_dir):
+    return (
+        os.path.join(pack_dir, "images.u8"),
+        os.path.join(pack_dir, "labels.npy"),
+        os.path.join(pack_dir, "active.npy"),
+        os.path.join(pack_dir, "manifest.json"),
+    )
+
+
+def _decode(path, size):
+    # Same resize as transforms.Resize((size, size)) on a PIL image
+    image = Image.open(path).convert("RGB").resize((size, size), Image.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)
+
+
+def _source_state(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def pack_samples(samples, pack_dir, size=224, workers=PACK_WORKERS):
+    """Pack (image_path, class_id) samples into pack_dir, decoding only new or changed images"""
+    os.makedirs(pack_dir, exist_ok=True)
+    images_path, labels_path, active_path, manifest_path = _paths(pack_dir)
+
+    manifest = {"size": size, "count": 0, "entries": {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest["size"] != size:
+            raise ValueError(f"{pack_dir} was packed at {manifest['size']}px, not {size}px - use a new pack dir")
+
+    entries = manifest["entries"]
+    new, changed = [], []
+    seen = set()
+    for img_path, class_id in samples:
+        seen.add(img_path)
+        mtime, nbytes = _source_state(img_path)
+        entry = entries.get(img_path)
+        if entry is None:
+            new.append((img_path, class_id, mtime, nbytes))
+            continue
+        entry["active"] = True
+        if entry["mtime"] != mtime or entry["bytes"] != nbytes or entry["label"] != class_id:
+            changed.append((img_path, class_id, mtime, nbytes))
+
+    # Images deleted from the train dirs stay in images.u8 but drop out of active.npy
+    removed = 0
+    for img_path, entry in entries.items():
+        if img_path not in seen and entry.get("active", True):
+            entry["active"] = False
+            removed += 1
+
+    # Drop rows appended by a run that crashed before writing its manifest
+    sample_bytes = size * size * 3
+    if os.path.exists(images_path) and os.path.getsize(images_path) > manifest["count"] * sample_bytes:
+        os.truncate(images_path, manifest["count"] * sample_bytes)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # Rewrite changed images in place
+        if changed:
+            images = np.memmap(images_path, dtype=np.uint8, mode="r+", shape=(manifest["count"], size, size, 3))
+            for (img_path, class_id, mtime, nbytes), array in zip(
+                changed, pool.map(lambda s: _decode(s[0], size), changed)
+            ):
+                entry = entries[img_path]
+                images[entry["row"]] = array
+                entry.update(mtime=mtime, bytes=nbytes, label=class_id)
+            images.flush()
+            del images
+
+        # Append new images to the end of the array file
+        if new:
+            with open(images_path, "ab") as f:
+                for (img_path, class_id, mtime, nbytes), array in zip(
+                    new, pool.map(lambda s: _decode(s[0], size), new)
+                ):
+                    f.write(array.tobytes())
+                    entries[img_path] = {
+                        "row": manifest["count"], "label": class_id,
+                        "mtime": mtime, "bytes": nbytes, "active": True,
+                    }
+                    manifest["count"] += 1
+
+    labels = np.zeros(manifest["count"], dtype=np.int64)
+    active = []
+    for entry in entries.values():
+        labels[entry["row"]] = entry["label"]
+        if entry.get("active", True):
+            active.append(entry["row"])
+    np.save(labels_path, labels)
+    np.save(active_path, np.array(sorted(active), dtype=np.int64))
+
+    # Manifest last: after a crash, the next run truncates and repacks the same images
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"Packed {pack_dir}: {len(new)} new, {len(changed)} changed, {removed} removed, "
+          f"{len(active)} active samples")
+    return len(active)
+
+
+class PackedPlantDiseaseDataset(Dataset):
+    """Reads pre-resized samples from a pack directory through a memmap"""
+
+    def __init__(self, pack_dir, transform=None):
+        self.transform = transform
+        images_path, labels_path, active_path, manifest_path = _paths(pack_dir)
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+        self.size = manifest["size"]
+        self.count = manifest["count"]
+        self.images_path = images_path
+        self.labels = np.load(labels_path)
+        self.rows = np.load(active_path)
+        # Opened lazily so each DataLoader worker maps the file itself
+        self._images = None
+
+        print(f"Loaded {len(self.rows)} packed samples from {pack_dir}")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            self._images = np.memmap(self.images_path, dtype=np.uint8, mode="r",
+                                     shape=(self.count, self.size, self.size, 3))
+        row = self.rows[idx]
+        # HWC uint8 -> CHW uint8 tensor; the copy detaches it from the memmap page
+        image = torch.from_numpy(np.array(self._images[row])).permute(2, 0, 1)
+
+        if self.transform:
+            image = self.transform(image)
+
+        return image, int(self.labels[row])
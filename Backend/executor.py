@@ -0,0 +1,109 @@
+"""
+Execution Layer
+Bounded thread pool that keeps blocking image and tensor work off the
+asyncio event loop (database work goes through the async engine)
+"""
+
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# CPU-bound work: image decode, preprocessing, tensor ops
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+# Torch intra-op threads, matched to the CPU pool so the forward pass uses the same cores
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(CPU_WORKERS)))
+# Calls allowed to wait behind the running ones, per worker, before we shed load
+QUEUE_PER_WORKER = int(os.getenv("POOL_QUEUE_PER_WORKER", "4"))
+# Seconds clients are told to back off when a pool is saturated
+RETRY_AFTER_SECONDS = int(os.getenv("BUSY_RETRY_AFTER", "1"))
+
+
+class ServerBusy(Exception):
+    """Raised when a pool is saturated; the API turns it into 503 + Retry-After"""
+
+    def __init__(self, pool_name, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(f"{pool_name} pool is saturated")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+async def collect_batch(queue, max_size, max_wait, items=None):
+    """Wait for one queue item, then keep taking items until max_size or max_wait seconds later
+
+    Appends to items when given, so a caller cancelled mid-collect still holds what was taken.
+    """
+    items = [] if items is None else items
+    items.append(await queue.get())
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait
+    while len(items) < max_size:
+        # Take whatever is already waiting without yielding
+        if not queue.empty():
+            items.append(queue.get_nowait())
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            # asyncio.timeout, unlike wait_for, never swallows a stop() cancellation
+            async with asyncio.timeout(remaining):
+                items.append(await queue.get())
+        except TimeoutError:
+            break
+    return items
+
+
+class BoundedPool:
+    """Thread pool that refuses new work instead of queueing without limit"""
+
+    def __init__(self, name, max_workers, queue_per_worker=QUEUE_PER_WORKER):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers * (1 + max(0, queue_per_worker))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        # Only touched from the event loop thread, so no lock is needed
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ServerBusy(self.name)
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(fn, *args, **kwargs)
+            if metrics.METRICS_ENABLED:
+                call = functools.partial(self._timed_call, call, time.perf_counter())
+            return await loop.run_in_executor(self._executor, call)
+        finally:
+            self.pending -= 1
+
+    def _timed_call(self, call, submitted_at):
+        # Time spent waiting for a free worker thread
+        metrics.observe_stage(f"{self.name}_queue", time.perf_counter() - submitted_at)
+        return call()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+
+cpu_pool = BoundedPool("cpu", CPU_WORKERS)
+
+
+def shutdown():
+    cpu_pool.shutdown()
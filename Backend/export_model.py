@@ -0,0 +1,147 @@
+"""
+Model Export Tool
+Turns plant_disease_model.pth into a frozen TorchScript module and an INT8-quantized
+variant, then reports accuracy vs latency of every backend on a held-out image set
+
+Usage:
+    python export_model.py --images path/to/heldout [--calibration 64] [--limit 500]
+
+Serve an exported backend with MODEL_BACKEND=torchscript or MODEL_BACKEND=int8.
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+import model_backends
+import preprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, "plant_disease_model.pth")
+CLASSES_PATH = os.path.join(BASE_DIR, "classes.json")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def load_images(image_dir, limit):
+    """Preprocess images with the serving path; labels come from YOLO .txt files when present"""
+    tensors, labels = [], []
+    for img_path in sorted(Path(image_dir).iterdir()):
+        if img_path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        with open(img_path, "rb") as f:
+            tensors.append(preprocess.preprocess(f.read()))
+
+        label = None
+        txt_path = img_path.with_suffix(".txt")
+        if txt_path.exists():
+            content = txt_path.read_text().strip()
+            if content:
+                label = int(content.split()[0])
+        labels.append(label)
+
+        if len(tensors) >= limit:
+            break
+    return tensors, labels
+
+
+def batches(tensors, batch_size):
+    for start in range(0, len(tensors), batch_size):
+        yield torch.stack(tensors[start:start + batch_size])
+
+
+def evaluate(model, tensors, channels_last, batch_size=16):
+    """Top-1 predictions, single-image latencies (ms) and batched throughput (images/s)"""
+    def prepare(batch):
+        return batch.contiguous(memory_format=torch.channels_last) if channels_last else batch
+
+    with torch.no_grad():
+        model(prepare(tensors[0].unsqueeze(0)))  # warm-up
+
+        latencies = []
+        predictions = []
+        for tensor in tensors:
+            start = time.perf_counter()
+            outputs = model(prepare(tensor.unsqueeze(0)))
+            latencies.append((time.perf_counter() - start) * 1000)
+            predictions.append(outputs.argmax(1).item())
+
+        start = time.perf_counter()
+        for batch in batches(tensors, batch_size):
+            model(prepare(batch))
+        throughput = len(tensors) / (time.perf_counter() - start)
+
+    return predictions, latencies, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TorchScript/INT8 backends and report accuracy vs latency")
+    parser.add_argument("--images", required=True, help="Held-out image directory (YOLO .txt labels optional)")
+    parser.add_argument("--calibration", type=int, default=64, help="Images used to calibrate INT8 observers")
+    parser.add_argument("--limit", type=int, default=500, help="Max held-out images in the report")
+    parser.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    with open(CLASSES_PATH, 'r') as f:
+        num_classes = len(json.load(f)['class_names'])
+
+    print(f"Loading images from {args.images}...")
+    tensors, labels = load_images(args.images, args.calibration + args.limit)
+    if len(tensors) <= args.calibration:
+        # Too few images to hold any out: calibrate and report on the same set
+        calibration, heldout, heldout_labels = tensors, tensors, labels
+    else:
+        calibration = tensors[:args.calibration]
+        heldout, heldout_labels = tensors[args.calibration:], labels[args.calibration:]
+    print(f"   {len(calibration)} calibration images, {len(heldout)} held-out images")
+
+    ts_path = model_backends.backend_path(args.model, "torchscript")
+    print(f"Exporting TorchScript to {ts_path}...")
+    model_backends.export_torchscript(args.model, num_classes, ts_path)
+
+    int8_path = model_backends.backend_path(args.model, "int8")
+    print(f"Exporting INT8 to {int8_path}...")
+    model_backends.export_int8(args.model, num_classes, batches(calibration, 16), int8_path)
+
+    cpu = torch.device("cpu")
+    runs = {
+        "eager": (model_backends.load_eager(args.model, num_classes, cpu), False),
+        "torchscript": (model_backends.load_model("torchscript", args.model, num_classes, cpu), True),
+        "int8": (model_backends.load_model("int8", args.model, num_classes, cpu), True),
+    }
+
+    report = {"held_out_images": len(heldout), "backends": {}}
+    reference = None
+    for name, (model, channels_last) in runs.items():
+        predictions, latencies, throughput = evaluate(model, heldout, channels_last)
+        if reference is None:
+            reference = predictions
+
+        labelled = [(p, l) for p, l in zip(predictions, heldout_labels) if l is not None]
+        report["backends"][name] = {
+            "top1_agreement_with_fp32": round(float(np.mean([p == r for p, r in zip(predictions, reference)])), 4),
+            "accuracy": round(float(np.mean([p == l for p, l in labelled])), 4) if labelled else None,
+            "latency_ms_mean": round(float(np.mean(latencies)), 2),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+            "throughput_images_per_s": round(throughput, 1),
+        }
+
+    print(f"\n{'backend':<12} {'agree':>7} {'acc':>7} {'mean ms':>9} {'p95 ms':>8} {'img/s':>8}")
+    for name, row in report["backends"].items():
+        accuracy = f"{row['accuracy'] * 100:.1f}%" if row["accuracy"] is not None else "-"
+        print(f"{name:<12} {row['top1_agreement_with_fp32'] * 100:>6.1f}% {accuracy:>7} "
+              f"{row['latency_ms_mean']:>9.2f} {row['latency_ms_p95']:>8.2f} {row['throughput_images_per_s']:>8.1f}")
+
+    report_path = os.path.join(os.path.dirname(os.path.abspath(args.model)), "export_report.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Backbone Feature Cache
+Runs a frozen backbone once per image and stores its pooled embedding on disk, so
+retraining the classifier head only does matrix math over cached features
+
+Layout of a feature cache directory:
+    features.f16    raw (N, dim) float16 array, appended to as new images arrive
+    manifest.json   backbone id, dim, and source path, mtime, byte size and row of every image
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+# Images per backbone forward pass while extracting
+FEATURE_BATCH_SIZE = int(os.getenv("FEATURE_BATCH_SIZE", "64"))
+# Batches between manifest checkpoints, so an interrupted extraction keeps its progress
+CHECKPOINT_EVERY = 50
+
+
+class _ImageList(Dataset):
+    def __init__(self, paths, transform):
+        self.paths = paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        return self.transform(Image.open(self.paths[idx]).convert('RGB'))
+
+
+def _paths(cache_dir):
+    return os.path.join(cache_dir, "features.f16"), os.path.join(cache_dir, "manifest.json")
+
+
+def _write_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def _load_manifest(manifest_path, backbone_id, dim):
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest["backbone"] == backbone_id and manifest["dim"] == dim:
+            return manifest
+        print(f"⚠️ Feature cache was built with {manifest['backbone']} - re-extracting for {backbone_id}")
+    return {"backbone": backbone_id, "dim": dim, "count": 0, "entries": {}}
+
+
+def cache_features(samples, cache_dir, backbone, backbone_id, dim, transform, device,
+                   num_workers=0, batch_size=FEATURE_BATCH_SIZE):
+    """(features, labels) tensors for (image_path, class_id) samples, extracting only unseen or changed images"""
+    os.makedirs(cache_dir, exist_ok=True)
+    features_path, manifest_path = _paths(cache_dir)
+    manifest = _load_manifest(manifest_path, backbone_id, dim)
+    entries = manifest["entries"]
+
+    # Drop rows appended after the last manifest checkpoint of a crashed run (or by an old backbone)
+    row_bytes = dim * 2
+    if os.path.exists(features_path) and os.path.getsize(features_path) > manifest["count"] * row_bytes:
+        os.truncate(features_path, manifest["count"] * row_bytes)
+
+    pending = []
+    for img_path, _ in samples:
+        stat = os.stat(img_path)
+        entry = entries.get(img_path)
+        if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["bytes"] != stat.st_size:
+            pending.append((img_path, stat.st_mtime_ns, stat.st_size))
+
+    print(f"Feature cache: {len(samples) - len(pending)} cached, {len(pending)} to extract")
+    if pending:
+        loader = DataLoader(_ImageList([p for p, _, _ in pending], transform), batch_size=batch_size,
+                            shuffle=False, num_workers=num_workers)
+        backbone = backbone.to(device).eval()
+        done = 0
+        # Changed images get a new row; their old row is simply no longer referenced
+        with open(features_path, "ab") as f, torch.inference_mode():
+            for batch_idx, images in enumerate(loader):
+                features = backbone(images.to(device)).float().cpu().numpy().astype(np.float16)
+                f.write(features.tobytes())
+                for img_path, mtime, nbytes in pending[done:done + len(features)]:
+                    entries[img_path] = {"row": manifest["count"], "mtime": mtime, "bytes": nbytes}
+                    manifest["count"] += 1
+                done += len(features)
+
+                if (batch_idx + 1) % CHECKPOINT_EVERY == 0:
+                    f.flush()
+                    _write_manifest(manifest_path, manifest)
+                    print(f"Extracted [{done}/{len(pending)}]")
+        _write_manifest(manifest_path, manifest)
+
+    labels = torch.tensor([class_id for _, class_id in samples], dtype=torch.long)
+    if not samples:
+        return torch.empty(0, dim), labels
+    stored = np.memmap(features_path, dtype=np.float16, mode="r", shape=(manifest["count"], dim))
+    rows = np.array([entries[img_path]["row"] for img_path, _ in samples], dtype=np.int64)
+    features = torch.from_numpy(stored[rows].astype(np.float32))
+    del stored
+    return features, labels
@@ -0,0 +1,74 @@
+"""
+Scan History Queries
+Keyset pagination on (timestamp, id), column-projected so rows skip ORM hydration
+"""
+
+import base64
+import binascii
+import datetime
+import os
+
+from sqlalchemy import and_, or_, select
+
+import models
+
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "10000"))
+
+HISTORY_COLUMNS = (
+    models.ScanLog.id,
+    models.ScanLog.disease_name,
+    models.ScanLog.confidence,
+    models.ScanLog.remedy,
+    models.ScanLog.timestamp,
+    models.ScanLog.model_version,
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, scan_id):
+    raw = f"{timestamp.isoformat()}|{scan_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, scan_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(scan_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+async def query_history(db, limit, cursor=None, disease=None, start=None, end=None):
+    """Newest-first page of scans as plain dicts, plus the cursor for the next page (or None)"""
+    scan = models.ScanLog
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    query = select(*HISTORY_COLUMNS)
+    if disease is not None:
+        query = query.where(scan.disease_name == disease)
+    start, end = models.naive_utc(start), models.naive_utc(end)
+    if start is not None:
+        query = query.where(scan.timestamp >= start)
+    if end is not None:
+        query = query.where(scan.timestamp < end)
+    if cursor is not None:
+        # Seek past the last row of the previous page instead of OFFSET-scanning to it
+        cursor_timestamp, cursor_id = decode_cursor(cursor)
+        query = query.where(or_(
+            scan.timestamp < cursor_timestamp,
+            and_(scan.timestamp == cursor_timestamp, scan.id < cursor_id),
+        ))
+
+    # One extra row tells us whether another page exists
+    result = await db.execute(query.order_by(scan.timestamp.desc(), scan.id.desc()).limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [row._asdict() for row in rows], next_cursor
@@ -0,0 +1,354 @@
+"""
+API Load Test
+Drives /predict, /history, /analytics and /analytics/trends with a weighted request mix
+at fixed concurrency, using synthetic JPEGs at phone-camera resolutions, and records
+throughput, latency percentiles and error rate as JSON so runs from different commits
+can be diffed
+
+Usage:
+    python loadtest.py --spawn mock --duration 30 --concurrency 16
+    python loadtest.py --url http://localhost:8000 --mix predict=8,history=1,analytics=1
+    python loadtest.py --compare before.json after.json
+
+Targets for --spawn (started with uvicorn on a free port, stopped afterwards):
+    main        main.py with the real model (falls back to mock without a checkpoint)
+    mock        main.py with USE_MOCK=1 - full request path minus the forward pass
+    mock_main   mock_main.py stand-in (only /predict exists there)
+"""
+
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+# Common phone camera outputs (12MP, 8MP, 1080p)
+PHONE_RESOLUTIONS = [(4032, 3024), (3264, 2448), (1920, 1080)]
+DEFAULT_MIX = "predict=8,history=1,analytics=1"
+SPAWN_TARGETS = {
+    "main": ("main:app", {}),
+    "mock": ("main:app", {"USE_MOCK": "1"}),
+    "mock_main": ("mock_main:app", {}),
+}
+
+
+# -------------------- SYNTHETIC IMAGES --------------------
+
+def synthetic_jpeg(width, height, seed, quality=90):
+    """Smooth leaf-like colour field plus sensor noise, so file sizes look like real photos"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(40, 200, size=(12, 16, 3), dtype=np.uint8)
+    base = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BICUBIC), dtype=np.int16)
+    noise = rng.integers(-12, 13, size=(height, width, 1), dtype=np.int16)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def synthetic_images(count, image_dir=None, resolutions=PHONE_RESOLUTIONS):
+    """count JPEG payloads cycling through resolutions, cached in image_dir when given"""
+    images = []
+    for i in range(count):
+        width, height = resolutions[i % len(resolutions)]
+        path = os.path.join(image_dir, f"synthetic_{i}_{width}x{height}.jpg") if image_dir else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                images.append(f.read())
+            continue
+
+        image_data = synthetic_jpeg(width, height, seed=i)
+        if path:
+            os.makedirs(image_dir, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(image_data)
+        images.append(image_data)
+    return images
+
+
+# -------------------- STATS --------------------
+
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.recording = False
+
+    def record(self, endpoint, status, latency):
+        if not self.recording:
+            return
+        self.latencies.setdefault(endpoint, []).append(latency)
+        codes = self.statuses.setdefault(endpoint, {})
+        codes[status] = codes.get(status, 0) + 1
+
+    def summary(self, elapsed):
+        def block(latencies, statuses):
+            total = sum(statuses.values())
+            errors = sum(n for code, n in statuses.items() if not str(code).startswith("2"))
+            return {
+                "requests": total,
+                "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "status_codes": {str(code): n for code, n in sorted(statuses.items(), key=str)},
+                **latency_summary(latencies),
+            }
+
+        endpoints = {
+            name: block(self.latencies[name], self.statuses[name]) for name in sorted(self.latencies)
+        }
+        all_statuses = {}
+        for statuses in self.statuses.values():
+            for code, n in statuses.items():
+                all_statuses[code] = all_statuses.get(code, 0) + n
+        all_latencies = [l for latencies in self.latencies.values() for l in latencies]
+        return {"overall": block(all_latencies, all_statuses), "endpoints": endpoints}
+
+
+# -------------------- LOAD GENERATOR --------------------
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("predict", "history", "analytics", "trends"):
+            raise ValueError(f"Unknown endpoint '{name}' in --mix")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def send(client, endpoint, images, rng, unique):
+    if endpoint == "predict":
+        image_data = rng.choice(images)
+        if unique:
+            # Bytes after the JPEG EOI marker are ignored by decoders but defeat the exact-match cache
+            image_data += rng.randbytes(16)
+        files = {"file": ("leaf.jpg", image_data, "image/jpeg")}
+        return await client.post("/predict", files=files)
+    if endpoint == "history":
+        return await client.get("/history", params={"limit": 50})
+    if endpoint == "trends":
+        return await client.get("/analytics/trends", params={"bucket": rng.choice(["day", "week"])})
+    return await client.get("/analytics")
+
+
+async def worker(client, recorder, weights, images, seed, deadline, remaining, unique):
+    rng = random.Random(seed)
+    names, endpoint_weights = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        if remaining is not None:
+            if remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+        endpoint = rng.choices(names, weights=endpoint_weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await send(client, endpoint, images, rng, unique)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        recorder.record(endpoint, status, time.perf_counter() - start)
+
+
+async def run_load(url, weights, images, concurrency, duration, warmup, total_requests, unique, timeout):
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        try:
+            server = (await client.get("/")).json()
+        except (httpx.HTTPError, ValueError):
+            server = None
+
+        if warmup > 0:
+            warm_deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(
+                worker(client, recorder, weights, images, 10_000 + i, warm_deadline, None, unique)
+                for i in range(concurrency)
+            ))
+
+        recorder.recording = True
+        remaining = [total_requests] if total_requests else None
+        deadline = time.perf_counter() + (duration if not total_requests else float("inf"))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, recorder, weights, images, i, deadline, remaining, unique)
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    result = recorder.summary(elapsed)
+    result["elapsed_s"] = round(elapsed, 2)
+    result["server"] = server
+    return result
+
+
+# -------------------- SPAWNED TARGET --------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(target, startup_timeout=120):
+    """Start the target with uvicorn in the Backend dir; returns (process, url)"""
+    app, extra_env = SPAWN_TARGETS[target]
+    port = free_port()
+    env = {**os.environ, **extra_env}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{app} exited with code {process.returncode} during startup")
+        try:
+            # Any HTTP answer (mock_main.py has no / route) means the server is accepting requests
+            httpx.get(url + "/", timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{app} did not start within {startup_timeout}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# -------------------- RESULTS --------------------
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(result, output):
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+def print_summary(result):
+    print(f"\n{'endpoint':>10} {'requests':>9} {'rps':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = [("overall", result["overall"])] + list(result["endpoints"].items())
+    for name, stats in rows:
+        print(f"{name:>10} {stats['requests']:>9} {stats['throughput_rps']:>8.1f} "
+              f"{100 * stats['error_rate']:>6.1f}% {stats.get('p50_ms', 0):>8.1f} "
+              f"{stats.get('p95_ms', 0):>8.1f} {stats.get('p99_ms', 0):>8.1f}")
+
+
+def flatten(data, prefix=""):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numeric leaves only"""
+    values = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(before_path, after_path):
+    """Print every numeric metric present in both result files with its relative change"""
+    with open(before_path, 'r') as f:
+        before = flatten(json.load(f).get("results", {}))
+    with open(after_path, 'r') as f:
+        after = flatten(json.load(f).get("results", {}))
+
+    print(f"{'metric':<50} {'before':>12} {'after':>12} {'change':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        change = f"{100 * (new - old) / old:+.1f}%" if old else "n/a"
+        print(f"{name:<50} {old:>12.2f} {new:>12.2f} {change:>8}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the Smart Farming API")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Base URL of a running server")
+    target.add_argument("--spawn", choices=sorted(SPAWN_TARGETS), help="Start this target locally for the run")
+    target.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Diff two result files")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured load first")
+    parser.add_argument("--images", type=int, default=6, help="Distinct synthetic JPEGs")
+    parser.add_argument("--image-dir", help="Cache the synthetic JPEGs here between runs")
+    parser.add_argument("--unique", action="store_true", help="Make every upload byte-unique (bypass exact cache)")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Results JSON (default: loadtest_<commit>_<time>.json)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    weights = parse_mix(args.mix)
+    print(f"Generating {args.images} synthetic JPEGs...")
+    images = synthetic_images(args.images, args.image_dir)
+    print(f"   sizes: {', '.join(f'{len(b) // 1024} KB' for b in images)}")
+
+    process = None
+    url = args.url or "http://localhost:8000"
+    if args.spawn:
+        print(f"Starting {args.spawn}...")
+        process, url = spawn_server(args.spawn)
+
+    try:
+        print(f"Load testing {url} with {args.concurrency} clients, mix {weights}...")
+        results = asyncio.run(run_load(url, weights, images, args.concurrency, args.duration, args.warmup,
+                                       args.requests, args.unique, args.timeout))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    print_summary(results)
+    commit = git_commit()
+    report = {
+        "kind": "loadtest",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "target": args.spawn or url,
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+        "results": results,
+    }
+    output = args.output or f"loadtest_{commit or 'nogit'}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    save_results(report, output)
@@ -1,24 +1,50 @@
-import io
 import os
-import json
+import hmac
+import asyncio
+import tarfile
+import zipfile
 import uvicorn
-import numpy as np
 from PIL import Image
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 import random
+from contextlib import asynccontextmanager, contextmanager
 
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException
+from fastapi import FastAPI, File, UploadFile, Depends, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic_core import to_json
+from sqlalchemy import exc as sa_exc, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import database
+import executor
+import history
+import metrics
+import model_runtime
 import models
+import prediction_cache
+import profiler
+import rollups
+import scan_writer
 import schemas
+import trends
+import uploads
 
 # -------------------- APP INITIALIZATION --------------------
 
-app = FastAPI(title="Smart Farming - Plant Disease Detection API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+app = FastAPI(title="Smart Farming - Plant Disease Detection API", lifespan=lifespan)
+
+# Upload size limits and the in-flight upload byte budget; inside CORS so rejections carry its headers
+app.add_middleware(uploads.UploadLimitMiddleware)
 
 # Enable CORS (Required for Flutter frontend)
 app.add_middleware(
@@ -27,151 +53,670 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Create database tables on startup
-models.Base.metadata.create_all(bind=database.engine)
+# Outermost, so request latency includes CORS and error handling
+app.add_middleware(metrics.MetricsMiddleware, on_request_done=profiler.profiler.request_done)
+
+# Saturated worker pools shed load instead of queueing without limit
+@app.exception_handler(executor.ServerBusy)
+async def server_busy_handler(request: Request, exc: executor.ServerBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {exc}"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
-# -------------------- LOAD ML MODEL --------------------
+# Every pooled DB connection stayed busy for DB_POOL_TIMEOUT: same backpressure as a saturated pool
+@app.exception_handler(sa_exc.TimeoutError)
+async def db_pool_timeout_handler(request: Request, exc: sa_exc.TimeoutError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy: database connection pool exhausted"},
+        headers={"Retry-After": str(executor.RETRY_AFTER_SECONDS)},
+    )
 
-USE_MOCK = False
-model = None
-device = None
+# Uploads over a byte or pixel limit
+@app.exception_handler(uploads.UploadTooLarge)
+@app.exception_handler(Image.DecompressionBombError)
+async def upload_too_large_handler(request: Request, exc: Exception):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+# Predictions that arrive while the model is loading or warming up
+@app.exception_handler(model_runtime.ModelLoading)
+async def model_loading_handler(request: Request, exc: model_runtime.ModelLoading):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# -------------------- ML MODEL --------------------
+
+# USE_MOCK=1 skips the model even when a checkpoint exists (load tests, frontend work)
+USE_MOCK = os.getenv("USE_MOCK", "0") == "1"
+# model_runtime.ServingModel, published once loaded and warmed up, replaced by hot reloads
+serving = None
 
-# Try to load PyTorch model
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "plant_disease_model.pth")
 CLASSES_PATH = os.path.join(os.path.dirname(__file__), "classes.json")
 
-try:
-    import torch
-    import torch.nn as nn
-    from torchvision import models as tv_models, transforms
-    
-    if os.path.exists(MODEL_PATH) and os.path.exists(CLASSES_PATH):
-        # Load class names and remedies
-        with open(CLASSES_PATH, 'r') as f:
-            classes_data = json.load(f)
-        
-        CLASS_NAMES = classes_data['class_names']  # Dict with int keys as strings
-        REMEDIES = classes_data['remedies']
-        
-        # Load model
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model = tv_models.resnet18(weights=None)
-        model.fc = nn.Linear(model.fc.in_features, len(CLASS_NAMES))
-        
-        checkpoint = torch.load(MODEL_PATH, map_location=device, weights_only=False)
-        model.load_state_dict(checkpoint['model_state_dict'])
-        model = model.to(device)
-        model.eval()
-        
-        # Image transform
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
-        
-        print(f"✅ Model loaded successfully with {len(CLASS_NAMES)} classes")
-        print(f"   Device: {device}")
-    else:
-        print(f"⚠️ Model file not found at {MODEL_PATH}")
-        USE_MOCK = True
-except ImportError:
-    print("⚠️ PyTorch not installed - using mock predictions")
-    USE_MOCK = True
-except Exception as e:
-    print(f"⚠️ Error loading model: {e}")
+# Seconds between checks of the checkpoint files for a hot reload (0: reload only via /admin/reload-model)
+MODEL_WATCH_SECONDS = float(os.getenv("MODEL_WATCH_SECONDS", "0"))
+# Required in the X-Admin-Token header of /admin endpoints; unset leaves them disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# "0": skip table creation, migrations and rollup backfill on startup (serve.py runs them once before forking)
+SETUP_DATABASE = os.getenv("SETUP_DATABASE", "1") == "1"
+
+# Recorded as the model version of mock predictions
+MOCK_VERSION = "mock"
+
+# Class names and remedies for mock mode
+MOCK_CLASS_NAMES = {
+    "0": "Apple_Scab", "1": "Apple_Black_Rot", "2": "Apple_Cedar_Rust",
+    "3": "Apple_Healthy", "4": "Blueberry_Healthy", "5": "Cherry_Powdery_Mildew"
+}
+MOCK_REMEDIES = {
+    "Apple_Scab": "Apply fungicide sprays. Remove fallen leaves.",
+    "Apple_Black_Rot": "Prune infected branches. Apply copper fungicide.",
+    "Apple_Cedar_Rust": "Remove nearby juniper trees. Apply fungicide.",
+    "Apple_Healthy": "No treatment needed. Continue regular care.",
+    "Blueberry_Healthy": "No treatment needed. Maintain watering.",
+    "Cherry_Powdery_Mildew": "Apply sulfur-based fungicide."
+}
+
+# -------------------- SCAN LOG PERSISTENCE --------------------
+
+scan_logs = scan_writer.ScanLogWriter()
+
+# -------------------- STARTUP AND SHUTDOWN --------------------
+
+startup_state = model_runtime.StartupState()
+load_task = None
+watch_task = None
+
+def setup_database():
+    # Create database tables on startup
+    models.Base.metadata.create_all(bind=database.engine)
+
+    # create_all skips existing tables, so add columns and indexes introduced after a table was created
+    table = models.ScanLog.__table__
+    existing = {column["name"] for column in inspect(database.engine).get_columns(table.name)}
+    with database.engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=database.engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    for index in table.indexes:
+        index.create(bind=database.engine, checkfirst=True)
+
+    # Backfill analytics rollups for databases that predate them
+    with database.SessionLocal() as startup_db:
+        rollups.ensure_rollups(startup_db)
+
+def use_mock_predictions(reason):
+    global USE_MOCK
     USE_MOCK = True
+    print(f"⚠️ {reason} - using mock predictions")
 
-# Fallback class names and remedies for mock mode
-if USE_MOCK:
-    CLASS_NAMES = {
-        "0": "Apple_Scab", "1": "Apple_Black_Rot", "2": "Apple_Cedar_Rust",
-        "3": "Apple_Healthy", "4": "Blueberry_Healthy", "5": "Cherry_Powdery_Mildew"
-    }
-    REMEDIES = {
-        "Apple_Scab": "Apply fungicide sprays. Remove fallen leaves.",
-        "Apple_Black_Rot": "Prune infected branches. Apply copper fungicide.",
-        "Apple_Cedar_Rust": "Remove nearby juniper trees. Apply fungicide.",
-        "Apple_Healthy": "No treatment needed. Continue regular care.",
-        "Blueberry_Healthy": "No treatment needed. Maintain watering.",
-        "Cherry_Powdery_Mildew": "Apply sulfur-based fungicide."
-    }
-    print("⚠️ Using mock predictions")
+def publish(loaded):
+    """Route new requests to loaded, with an empty prediction cache of its own"""
+    global serving
+    if prediction_cache.PREDICTION_CACHE_ENABLED:
+        # Scoped to the model, so a reload can never serve the previous model's results
+        loaded.cache = prediction_cache.PredictionCache()
+    serving = loaded
 
-# -------------------- HEALTH CHECK --------------------
+async def load_model():
+    """Load and warm up the model off the event loop, then publish it for /predict"""
+    global watch_task
+    try:
+        # Torch import and weight loading run in a thread, so liveness probes keep answering
+        loaded = await asyncio.to_thread(model_runtime.load_serving_model, MODEL_PATH, CLASSES_PATH, startup_state)
+        with startup_state.phase("warm_up"):
+            await loaded.warm_up()
+    except Exception as e:
+        reason = "PyTorch not installed" if isinstance(e, ImportError) else f"Error loading model: {e}"
+        use_mock_predictions(reason)
+        # A checkpoint is deployed but unusable: stay unready, so no traffic is routed to mock diagnoses
+        startup_state.mark_failed(reason)
+        return
+    else:
+        publish(loaded)
+
+        print(f"✅ Model loaded successfully with {len(loaded.class_names)} classes (version {loaded.version})")
+        print(f"   Device: {loaded.device}, backend: {loaded.backend}")
+        print(f"   Batching: max {loaded.engine.max_batch_size} images / {loaded.engine.max_wait * 1000:.1f} ms")
+        if MODEL_WATCH_SECONDS > 0:
+            watch_task = asyncio.create_task(watch_model_files())
+    startup_state.mark_ready()
+    print(f"✅ Ready in {startup_state.phases['total']:.0f} ms")
+
+async def startup():
+    global load_task
+    print("Starting Smart Farming API...")
+    if SETUP_DATABASE:
+        with startup_state.phase("database"):
+            await asyncio.to_thread(setup_database)
+    await scan_logs.start()
+
+    if USE_MOCK:
+        use_mock_predictions("USE_MOCK=1")
+    elif not (os.path.exists(MODEL_PATH) and os.path.exists(CLASSES_PATH)):
+        use_mock_predictions(f"Model file not found at {MODEL_PATH}")
+    elif model_runtime.MODEL_LOAD_BLOCKING:
+        await load_model()
+        return
+    else:
+        load_task = asyncio.create_task(load_model())
+        return
+    startup_state.mark_ready()
+
+async def shutdown():
+    for task in (load_task, watch_task):
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if serving is not None:
+        await serving.engine.stop()
+    # Models replaced by a reload, still finishing their last requests
+    await asyncio.gather(*retiring, return_exceptions=True)
+    # Drains the write-behind queue, so it must run before the DB engine is disposed
+    await scan_logs.stop()
+    executor.shutdown()
+    await database.async_engine.dispose()
+    profiler.profiler.stop()
+
+# -------------------- HEALTH CHECKS --------------------
+
+def model_status():
+    if USE_MOCK:
+        return "mock"
+    return "loaded" if serving is not None else "loading"
+
+def current_model_version():
+    if USE_MOCK:
+        return MOCK_VERSION
+    return serving.version if serving is not None else None
 
 @app.get("/")
 async def health_check():
+    # Liveness: answers as soon as the process is up, even while the model is loading
     return {
         "status": "healthy",
         "message": "Smart Farming API is running",
-        "ml_model": "loaded" if not USE_MOCK else "mock"
+        "ml_model": model_status(),
+        "model_version": current_model_version(),
+        "backend": serving.backend if serving is not None else None
     }
 
+@app.get("/ready")
+async def readiness_check():
+    # Readiness: 503 until the model is loaded and warm (or mock mode is settled)
+    return JSONResponse(
+        status_code=200 if startup_state.ready else 503,
+        content={
+            "ready": startup_state.ready,
+            "ml_model": model_status(),
+            "model_version": current_model_version(),
+            **startup_state.report(),
+        },
+    )
+
+# -------------------- HOT MODEL RELOAD --------------------
+
+reload_lock = asyncio.Lock()
+# retire() tasks of replaced models, awaited on shutdown
+retiring = set()
+reload_stats = {"reloads": 0, "unchanged": 0, "failures": 0, "last_error": None}
+
+async def reload_model(force=False):
+    """Load the checkpoint files on disk next to the serving model, warm them up, then swap them in
+
+    Requests already running finish on the previous model, whose batching engine is stopped
+    once the last of them is done. Unless force is set, files whose content hash matches the
+    serving version are left alone.
+    """
+    async with reload_lock:
+        previous = serving
+        if previous is None:
+            raise model_runtime.ModelLoading()
+
+        state = model_runtime.StartupState()
+        try:
+            version = await asyncio.to_thread(
+                model_runtime.checkpoint_version, *model_runtime.checkpoint_files(MODEL_PATH, CLASSES_PATH)
+            )
+            if version == previous.version and not force:
+                reload_stats["unchanged"] += 1
+                return {"status": "unchanged", "model_version": version}
+
+            # Loads while the previous model keeps serving; its preloaded weights are the ones being replaced
+            loaded = await asyncio.to_thread(model_runtime.load_serving_model, MODEL_PATH, CLASSES_PATH, state, False)
+            with state.phase("warm_up"):
+                await loaded.warm_up()
+        except Exception as e:
+            reload_stats["failures"] += 1
+            reload_stats["last_error"] = str(e)
+            raise
+        state.mark_ready()
+
+        # Atomic for every request that has not pinned a model yet: they all run on the new one
+        publish(loaded)
+        if previous.cache is not None:
+            previous.cache.invalidate()
+        task = asyncio.create_task(previous.retire())
+        retiring.add(task)
+        task.add_done_callback(retiring.discard)
+
+        reload_stats["reloads"] += 1
+        reload_stats["last_error"] = None
+        print(f"✅ Model reloaded: {previous.version} -> {loaded.version} in {state.phases['total']:.0f} ms")
+        return {
+            "status": "reloaded",
+            "previous_version": previous.version,
+            "model_version": loaded.version,
+            "phases_ms": state.phases,
+        }
+
+async def watch_model_files():
+    """Poll the checkpoint files and hot-reload once a change has been stable for one interval"""
+    def fingerprint():
+        return model_runtime.file_fingerprint(*model_runtime.checkpoint_files(MODEL_PATH, CLASSES_PATH))
+
+    seen = fingerprint()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_SECONDS)
+        changed = fingerprint()
+        if changed == seen:
+            continue
+        # A deploy may still be copying the files; wait until they stop changing
+        await asyncio.sleep(MODEL_WATCH_SECONDS)
+        if fingerprint() != changed or None in changed:
+            continue
+        seen = changed
+        try:
+            await reload_model()
+        except Exception as e:
+            print(f"⚠️ Model reload failed, still serving version {serving.version}: {e}")
+
+if ADMIN_TOKEN:
+    @app.post("/admin/reload-model")
+    async def reload_model_endpoint(force: bool = False, x_admin_token: str = Header("")):
+        """Hot-reload the checkpoint and classes.json from disk without dropping requests"""
+        if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+        if USE_MOCK:
+            raise HTTPException(status_code=409, detail="Serving mock predictions, there is no model to reload")
+        if reload_lock.locked():
+            raise HTTPException(status_code=409, detail="A model reload is already running")
+        try:
+            return await reload_model(force)
+        except model_runtime.ModelLoading:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Model reload failed: {str(e)}")
+
+# -------------------- BLOCKING WORK (runs on executor pools) --------------------
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+def load_image(image_data):
+    with metrics.stage("decode"):
+        return uploads.open_image(image_data).convert("RGB")
+
+def preprocess_image(image_data):
+    # Imported on first use: preprocess pulls in torch, which loads in the background
+    import preprocess
+
+    # Reduced-size JPEG decode + single-pass normalize, matches the training transform
+    with metrics.stage("decode"):
+        image = preprocess.decode(image_data, max_pixels=uploads.MAX_IMAGE_PIXELS)
+    with metrics.stage("preprocess"):
+        return preprocess.to_tensor(image)
+
+def hash_upload(image_data):
+    with metrics.stage("hash"):
+        return prediction_cache.content_key(image_data)
+
+def preprocess_with_keys(image_data, perceptual_keys):
+    """Hash the upload, then decode and preprocess it; returns (tensor, content_key, perceptual_key)"""
+    import preprocess
+
+    with metrics.stage("decode"):
+        image = preprocess.decode(image_data, max_pixels=uploads.MAX_IMAGE_PIXELS)
+    perceptual = None
+    if perceptual_keys:
+        with metrics.stage("perceptual_hash"):
+            perceptual = prediction_cache.perceptual_key(image)
+    with metrics.stage("preprocess"):
+        tensor = preprocess.to_tensor(image)
+    return tensor, hash_upload(image_data), perceptual
+
+def is_archive(filename):
+    return (filename or "").lower().endswith(ARCHIVE_EXTENSIONS)
+
+def list_archive(archive):
+    """Return (name, size) for every image file inside a zip or tar upload, from its index alone"""
+    archive.seek(0)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            return [
+                (info.filename, info.file_size)
+                for info in zf.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tf:
+        return [
+            (member.name, member.size)
+            for member in tf.getmembers()
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+def extract_archive(archive):
+    """Return (name, bytes) for every image file inside a zip or tar upload"""
+    archive.seek(0)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            return [
+                (info.filename, zf.read(info))
+                for info in zf.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tf:
+        return [
+            (member.name, tf.extractfile(member).read())
+            for member in tf.getmembers()
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+# -------------------- CLASSIFICATION --------------------
+
+@contextmanager
+def model_in_use():
+    """Pin the serving model (None in mock mode) for one request, so the whole request runs on it
+    even if a hot reload swaps in a new model meanwhile"""
+    if USE_MOCK:
+        yield None
+        return
+
+    serving_model = serving
+    if serving_model is None:
+        raise model_runtime.ModelLoading()
+    with serving_model.pinned():
+        yield serving_model
+
+async def prepare(image_data, serving_model):
+    """Decode and preprocess on the CPU pool.
+
+    Returns (serving_model, img_tensor, cache_keys, cached_result): img_tensor is None in
+    mock mode and on a cache hit, cached_result is set only on a hit.
+    """
+    if serving_model is None:
+        # Mock mode: still decode so invalid uploads are rejected like in real mode
+        await executor.cpu_pool.run(load_image, image_data)
+        return None, None, (), None
+
+    cache = serving_model.cache
+    if cache is None:
+        return serving_model, await executor.cpu_pool.run(preprocess_image, image_data), (), None
+
+    # Exact repeat: hashing is far cheaper than decoding, so try it first
+    content_key = await executor.cpu_pool.run(hash_upload, image_data)
+    cached_result = cache.get(content_key)
+    if cached_result is not None:
+        return serving_model, None, (), cached_result
+
+    img_tensor, content_key, perceptual_key = await executor.cpu_pool.run(
+        preprocess_with_keys, image_data, cache.perceptual
+    )
+    if perceptual_key is not None:
+        cached_result = cache.get(perceptual_key)
+        if cached_result is not None:
+            cache.put(content_key, cached_result)
+            return serving_model, None, (), cached_result
+
+    return serving_model, img_tensor, (content_key, perceptual_key), None
+
+async def infer(prepared):
+    """Classify a prepared image; returns (disease_name, confidence, remedy)"""
+    serving_model, img_tensor, cache_keys, cached_result = prepared
+    if cached_result is not None:
+        return cached_result
+
+    if img_tensor is None:
+        # Mock prediction for testing
+        predicted_class = random.choice(list(MOCK_CLASS_NAMES.values()))
+        confidence = round(random.uniform(85.0, 99.9), 2)
+        return predicted_class, confidence, MOCK_REMEDIES.get(predicted_class, model_runtime.DEFAULT_REMEDY)
+
+    # Batched with other in-flight requests by the engine
+    result = await serving_model.predict(img_tensor)
+
+    for key in cache_keys:
+        serving_model.cache.put(key, result)
+    return result
+
+def version_of(serving_model):
+    return serving_model.version if serving_model is not None else MOCK_VERSION
+
+async def classify(image_data):
+    """Returns ((disease_name, confidence, remedy), model_version)"""
+    with model_in_use() as serving_model:
+        return await infer(await prepare(image_data, serving_model)), version_of(serving_model)
+
 # -------------------- PREDICTION ENDPOINT --------------------
 
 @app.post("/predict", response_model=schemas.PredictionResponse)
-async def predict(
-    file: UploadFile = File(...),
-    db: Session = Depends(database.get_db)
-):
+async def predict(file: UploadFile = File(...)):
     try:
-        # Read image bytes
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
-
-        if USE_MOCK or model is None:
-            # Mock prediction for testing
-            class_names_list = list(CLASS_NAMES.values())
-            predicted_class = random.choice(class_names_list)
-            confidence = round(random.uniform(85.0, 99.9), 2)
-        else:
-            # Real PyTorch prediction
-            img_tensor = transform(image).unsqueeze(0).to(device)
-            
-            with torch.no_grad():
-                outputs = model(img_tensor)
-                probabilities = torch.nn.functional.softmax(outputs, dim=1)
-                confidence_val, predicted_idx = torch.max(probabilities, 1)
-                
-            predicted_class = CLASS_NAMES[str(predicted_idx.item())]
-            confidence = round(confidence_val.item() * 100, 2)
-
-        remedy_text = REMEDIES.get(predicted_class, "Consult an agronomist for proper treatment.")
-
-        # Save to database
-        new_log = models.ScanLog(
-            disease_name=predicted_class,
-            confidence=confidence,
-            remedy=remedy_text
-        )
-        db.add(new_log)
-        db.commit()
+        # Hashed and decoded straight from the spooled upload file, never read into one bytes object
+        metrics.observe_upload("/predict", file.size or 0)
+        (predicted_class, confidence, remedy_text), model_version = await classify(file.file)
+
+        # Save to database (committed now, or queued in write-behind mode)
+        with metrics.stage("persist"):
+            await scan_logs.record(scan_writer.scan_log_row(predicted_class, confidence, remedy_text, model_version))
 
         return {
             "disease_name": predicted_class,
             "confidence": confidence,
-            "remedy": remedy_text
+            "remedy": remedy_text,
+            "model_version": model_version
         }
 
+    except (executor.ServerBusy, model_runtime.ModelLoading, uploads.UploadTooLarge, Image.DecompressionBombError,
+            sa_exc.TimeoutError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+# -------------------- BATCH PREDICTION ENDPOINT --------------------
+
+async def stream_batch_predictions(images):
+    # Decode at most one image per CPU worker at a time so a big batch can't trip the pool's 503...
+    decode_slots = asyncio.Semaphore(executor.cpu_pool.max_workers)
+    # ...and cap decoded-but-unclassified tensors so memory stays flat for archives of any size
+    inflight_slots = asyncio.Semaphore(2 * (serving.engine.max_batch_size if serving is not None else 16))
+
+    async def run_one(filename, image_data):
+        async with inflight_slots:
+            try:
+                with model_in_use() as serving_model:
+                    async with decode_slots:
+                        prepared = await prepare(image_data, serving_model)
+                    # Many images queue up together, so the engine fills whole batches
+                    predicted_class, confidence, remedy_text = await infer(prepared)
+            except Exception as e:
+                return schemas.BatchPredictionError(filename=filename, error=str(e))
+
+            return schemas.BatchPredictionResponse(
+                filename=filename,
+                disease_name=predicted_class,
+                confidence=confidence,
+                remedy=remedy_text,
+                model_version=version_of(serving_model)
+            )
+
+    tasks = [asyncio.create_task(run_one(name, data)) for name, data in images]
+    rows = []
+    try:
+        # Emit each image's line the moment it is ready, not in upload order
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            if isinstance(result, schemas.BatchPredictionResponse):
+                rows.append(scan_writer.scan_log_row(result.disease_name, result.confidence, result.remedy,
+                                                     result.model_version))
+            yield result.model_dump_json() + "\n"
+
+            # Bulk inserts as results stream out, so a DB error ends the stream instead of following it
+            if len(rows) >= scan_writer.SCAN_LOG_FLUSH_SIZE:
+                pending, rows = rows, []
+                await scan_logs.record_many(pending)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Results already sent are saved even if the client disconnected; shielded because a
+        # disconnect runs this inside a cancelled task
+        if rows:
+            await asyncio.shield(asyncio.ensure_future(scan_logs.record_many(rows)))
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, files: List[UploadFile] = File(...)):
+    if not USE_MOCK and serving is None:
+        raise model_runtime.ModelLoading()
+
+    images = []
+    extracted_bytes = 0
+    for upload in files:
+        metrics.observe_upload("/predict/batch", upload.size or 0)
+        if not is_archive(upload.filename):
+            # Loose images stay in their spooled upload files until decoded
+            images.append((upload.filename, upload.file))
+            continue
+
+        try:
+            members = await executor.cpu_pool.run(list_archive, upload.file)
+            # Sizes come from the archive index, so oversize members are refused before extraction
+            for name, size in members:
+                if size > uploads.MAX_UPLOAD_BYTES:
+                    raise uploads.UploadTooLarge(f"{name} in {upload.filename} is {size / uploads.MB:.1f} MB, "
+                                                 f"limit is {uploads.MAX_UPLOAD_BYTES / uploads.MB:.1f} MB")
+            size = sum(size for _, size in members)
+            extracted_bytes += size
+            if extracted_bytes > uploads.MAX_BATCH_UPLOAD_BYTES:
+                raise uploads.UploadTooLarge(f"Archives expand to {extracted_bytes / uploads.MB:.1f} MB, "
+                                             f"limit is {uploads.MAX_BATCH_UPLOAD_BYTES / uploads.MB:.1f} MB")
+            # Extracted members live in memory until classified, so they count towards the upload budget
+            await uploads.reserve(request, size)
+            images.extend(await executor.cpu_pool.run(extract_archive, upload.file))
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive {upload.filename}: {str(e)}")
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    return StreamingResponse(stream_batch_predictions(images), media_type="application/x-ndjson")
+
+# -------------------- INFERENCE STATS ENDPOINT --------------------
+
+def cache_stats():
+    return serving.cache.stats() if serving is not None and serving.cache is not None else None
+
+@app.get("/inference/stats")
+async def get_inference_stats():
+    cache = cache_stats()
+    return {
+        "model": {"version": current_model_version(), "retiring": len(retiring), **reload_stats},
+        "batching": {"enabled": True, **serving.engine.stats()} if serving is not None else {"enabled": False},
+        "pools": {"cpu": executor.cpu_pool.stats(), "db": database.pool_stats()},
+        "cache": {"enabled": True, **cache} if cache is not None else {"enabled": False},
+        "scan_logs": scan_logs.stats(),
+        "uploads": uploads.upload_budget.stats(),
+    }
+
+# -------------------- METRICS AND PROFILING --------------------
+
+def numeric_stats(stats_fn):
+    """Gauge callback exposing the numeric fields of a stats() dict as {(field,): value}"""
+    def collect():
+        stats = stats_fn()
+        return {(k,): v for k, v in (stats or {}).items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    return collect
+
+metrics.gauge_callback("plant_cpu_pool", "CPU worker pool state", ("field",), numeric_stats(executor.cpu_pool.stats))
+metrics.gauge_callback("plant_db_pool", "Async DB connection pool state", ("field",), numeric_stats(database.pool_stats))
+metrics.gauge_callback("plant_scan_log_writer", "ScanLog writer state", ("field",), numeric_stats(scan_logs.stats))
+metrics.gauge_callback("plant_upload_budget", "In-flight upload byte budget", ("field",),
+                       numeric_stats(uploads.upload_budget.stats))
+metrics.gauge_callback("plant_batching", "Micro-batching engine state", ("field",),
+                       numeric_stats(lambda: serving.engine.stats() if serving is not None else None))
+metrics.gauge_callback("plant_prediction_cache", "Prediction cache state", ("field",),
+                       numeric_stats(cache_stats))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+if profiler.PROFILER_ENABLED:
+    @app.post("/debug/profile", status_code=202)
+    async def start_profile(requests: int = 20, interval_ms: float = profiler.PROFILE_INTERVAL_MS):
+        """Sample all threads for the next `requests` requests; fetch the result with GET"""
+        try:
+            profiler.profiler.arm(requests, interval_ms=interval_ms)
+        except profiler.ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return {"status": "armed", "requests": requests, "interval_ms": interval_ms}
+
+    @app.get("/debug/profile")
+    async def get_profile():
+        """Collapsed stacks of the last finished capture"""
+        if profiler.profiler.running:
+            return JSONResponse(status_code=202, content={"status": "running"})
+        result = profiler.profiler.result
+        if result is None:
+            raise HTTPException(status_code=404, detail="No profile captured yet")
+        headers = {f"X-Profile-{k.title().replace('_', '-')}": str(result[k]) for k in ("requests", "samples", "duration_s")}
+        return PlainTextResponse(result["collapsed"], headers=headers)
+
 # -------------------- HISTORY ENDPOINT --------------------
 
 @app.get("/history", response_model=List[schemas.PredictionHistoryResponse])
-async def get_history(limit: int = 50, db: Session = Depends(database.get_db)):
-    return db.query(models.ScanLog).order_by(
-        models.ScanLog.timestamp.desc()
-    ).limit(limit).all()
+async def get_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    disease: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(database.get_db)
+):
+    try:
+        rows, next_cursor = await history.query_history(
+            db, limit, cursor=cursor, disease=disease, start=start, end=end
+        )
+    except history.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Rows are already plain dicts of the response fields: serialize directly instead of
+    # validating each one through the response model
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content=to_json(rows), media_type="application/json", headers=headers)
 
 # -------------------- ANALYTICS ENDPOINT --------------------
 
-@app.get("/analytics", response_model=schemas.AnalyticsResponse)
-async def get_analytics(db: Session = Depends(database.get_db)):
-    total_scans = db.query(models.ScanLog).count()
+analytics_cache = rollups.TTLCache()
+
+async def compute_analytics(db: AsyncSession):
+    # O(number of classes) rows from the rollup table, not a scan of scan_logs
+    disease_totals = await rollups.disease_totals(db)
+    total_scans = sum(d.scan_count for d in disease_totals)
     
     if total_scans == 0:
         return {
@@ -181,30 +726,48 @@ async def get_analytics(db: Session = Depends(database.get_db)):
             "average_confidence": 0.0
         }
     
-    disease_counts = db.query(
-        models.ScanLog.disease_name,
-        func.count(models.ScanLog.id).label('count')
-    ).group_by(models.ScanLog.disease_name).all()
-    
     disease_distribution = [
         schemas.DiseaseStats(
             disease_name=d.disease_name,
-            count=d.count,
-            percentage=round((d.count / total_scans) * 100, 2)
+            count=d.scan_count,
+            percentage=round((d.scan_count / total_scans) * 100, 2)
         )
-        for d in disease_counts
+        for d in disease_totals if d.scan_count > 0
     ]
     
-    most_common = max(disease_counts, key=lambda x: x.count) if disease_counts else None
-    avg_confidence = db.query(func.avg(models.ScanLog.confidence)).scalar() or 0.0
+    most_common = max(disease_totals, key=lambda x: x.scan_count)
+    avg_confidence = sum(d.confidence_sum for d in disease_totals) / total_scans
     
     return {
         "total_scans": total_scans,
         "disease_distribution": disease_distribution,
-        "most_common_disease": most_common.disease_name if most_common else None,
+        "most_common_disease": most_common.disease_name,
         "average_confidence": round(float(avg_confidence), 2)
     }
 
+@app.get("/analytics", response_model=schemas.AnalyticsResponse)
+async def get_analytics(db: AsyncSession = Depends(database.get_db)):
+    # Dashboards poll this; a short TTL absorbs the bursts
+    analytics = analytics_cache.get()
+    if analytics is None:
+        analytics = await compute_analytics(db)
+        analytics_cache.set(analytics)
+    return analytics
+
+@app.get("/analytics/trends", response_model=schemas.TrendsResponse)
+async def get_trends(
+    bucket: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    disease: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_db)
+):
+    # Served from the hour/day trend rollups; weeks and months are summed from days
+    try:
+        return await trends.query_trends(db, bucket=bucket, start=start, end=end, disease=disease)
+    except trends.InvalidTrendQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # -------------------- SERVER START --------------------
 
 if __name__ == "__main__":
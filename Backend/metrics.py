@@ -0,0 +1,259 @@
+"""
+Serving Metrics
+Per-stage latency histograms, request counters and gauges for the /predict hot path,
+rendered in the Prometheus text exposition format by /metrics
+
+Recording is a perf_counter() pair plus a bisect under a lock per observation;
+METRICS=0 turns every helper into a no-op.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+
+# Seconds: 0.5ms .. 10s, covers a cache hit up to a slow 12MP decode under load
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes: 16KB .. 64MB uploads
+SIZE_BUCKETS = tuple(2 ** p for p in range(14, 27, 2))
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, plus the +Inf bucket, sum and count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Set directly, or computed at scrape time by a callback returning {label_tuple: value}"""
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            values = sorted(self.callback().items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A failing scrape callback must not take the other metrics down with it
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "plant_stage_seconds", "Time spent in each /predict pipeline stage", labelnames=("stage",)))
+request_seconds = registry.register(Histogram(
+    "plant_http_request_seconds", "HTTP request latency by route", labelnames=("route", "method")))
+requests_total = registry.register(Counter(
+    "plant_http_requests_total", "HTTP requests by route and status code", labelnames=("route", "method", "status")))
+requests_in_flight = registry.register(Gauge(
+    "plant_http_requests_in_flight", "Requests currently being handled", labelnames=("route",)))
+upload_bytes = registry.register(Histogram(
+    "plant_upload_bytes", "Size of uploaded images and archives", buckets=SIZE_BUCKETS, labelnames=("route",)))
+batch_size = registry.register(Histogram(
+    "plant_model_batch_size", "Images per model forward pass", buckets=BATCH_BUCKETS))
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_seconds.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+
+class _NoopStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+def stage(name):
+    """with metrics.stage("decode"): ... - records the block's duration"""
+    return _Stage(name) if METRICS_ENABLED else _NOOP_STAGE
+
+
+def observe_stage(name, seconds):
+    if METRICS_ENABLED:
+        stage_seconds.observe(seconds, name)
+
+
+def observe_upload(route, nbytes):
+    if METRICS_ENABLED:
+        upload_bytes.observe(nbytes, route)
+
+
+def observe_batch(size):
+    if METRICS_ENABLED:
+        batch_size.observe(size)
+
+
+def gauge_callback(name, help_text, labelnames, callback):
+    """Register a gauge whose values are read from callback() on every scrape"""
+    return registry.register(Gauge(name, help_text, labelnames=labelnames, callback=callback))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: in-flight gauge, latency histogram and status counter per route"""
+
+    def __init__(self, app, on_request_done=None):
+        self.app = app
+        self.on_request_done = on_request_done
+        self._routes = None
+
+    def _route(self, scope):
+        # Label by known route paths only, so random URLs can't blow up series cardinality
+        if self._routes is None:
+            router = scope.get("app")
+            routes = getattr(router, "routes", [])
+            self._routes = {getattr(route, "path", None) for route in routes} - {None}
+        path = scope["path"]
+        return path if path in self._routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            if self.on_request_done is not None:
+                self.on_request_done(scope["path"])
+            return
+
+        route = self._route(scope)
+        method = scope["method"]
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        requests_in_flight.inc(route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_seconds.observe(time.perf_counter() - start, route, method)
+            requests_total.inc(route, method, str(status[0]))
+            requests_in_flight.dec(route)
+            if self.on_request_done is not None:
+                self.on_request_done(route)
+
+
+def render():
+    return registry.render()
@@ -0,0 +1,195 @@
+"""
+Serving Micro-benchmarks
+Times each /predict stage in isolation - JPEG decode, preprocess, forward pass and the
+ScanLog commit - and saves the numbers as JSON in the same format loadtest.py compares
+
+Usage:
+    python microbench.py                        # all stages, synthetic phone-size JPEGs
+    python microbench.py --stages forward --batch-sizes 1,8,32
+    python loadtest.py --compare before.json after.json
+
+The DB stage writes to a throwaway SQLite file unless --db-url is given.
+"""
+
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+STAGES = ("decode", "preprocess", "forward", "db")
+
+
+def summarize(samples):
+    values = np.array(samples) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+    }
+
+
+def timed(fn, repeat, warmup=2):
+    """Latency summary of fn() over repeat calls, in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def timed_async(fn, repeat, warmup=2):
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_decode(images, repeat):
+    from PIL import Image
+    import preprocess
+
+    results = {}
+    for label, image_data in images.items():
+        results[label] = {
+            "full": timed(lambda: Image.open(io.BytesIO(image_data)).convert("RGB").load(), repeat),
+            "draft": timed(lambda: preprocess.decode(image_data, fast=True).load(), repeat),
+        }
+    return results
+
+
+def bench_preprocess(images, repeat):
+    import preprocess
+
+    results = {}
+    for label, image_data in images.items():
+        transform = preprocess.reference_transform()
+        decoded = preprocess.decode(image_data)
+        results[label] = {
+            "torchvision": timed(lambda: transform(preprocess.decode(image_data, fast=False)), repeat),
+            "fast_path": timed(lambda: preprocess.preprocess(image_data), repeat),
+            "to_tensor_only": timed(lambda: preprocess.to_tensor(decoded), repeat),
+        }
+    return results
+
+
+def bench_forward(batch_sizes, repeat, model_path):
+    import torch
+    import executor
+    import model_backends
+
+    torch.set_num_threads(executor.TORCH_THREADS)
+    device = torch.device("cpu")
+    if os.path.exists(model_path):
+        with open(os.path.join(os.path.dirname(model_path), "classes.json"), 'r') as f:
+            num_classes = len(json.load(f)["class_names"])
+        model = model_backends.load_model(model_backends.MODEL_BACKEND, model_path, num_classes, device)
+        source = model_backends.MODEL_BACKEND
+    else:
+        print(f"⚠️ {model_path} not found - timing an untrained ResNet18")
+        model = model_backends.build_resnet18(30).eval()
+        source = "untrained"
+
+    results = {"model": source}
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 224, 224)
+        if model_backends.MODEL_CHANNELS_LAST:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+
+        def forward():
+            with torch.inference_mode():
+                model(batch)
+
+        stats = timed(forward, repeat)
+        stats["images_per_sec"] = round(batch_size * 1000 / stats["mean_ms"], 1)
+        results[f"batch_{batch_size}"] = stats
+    return results
+
+
+async def bench_db(repeat, batch_size):
+    import database
+    import models
+    import scan_writer
+
+    models.Base.metadata.create_all(bind=database.engine)
+    row = lambda: scan_writer.scan_log_row("Apple_Scab", 97.5, "Apply fungicide sprays.")
+
+    single = await timed_async(lambda: scan_writer.save_scan_logs([row()]), repeat)
+    batched = await timed_async(lambda: scan_writer.save_scan_logs([row() for _ in range(batch_size)]), repeat)
+    batched["per_row_ms"] = round(batched["mean_ms"] / batch_size, 3)
+    await database.async_engine.dispose()
+    return {"dialect": database.engine.dialect.name, "single_row": single, f"batch_{batch_size}": batched}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the /predict stages")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per measurement")
+    parser.add_argument("--batch-sizes", default="1,4,8,16", help="Forward-pass batch sizes")
+    parser.add_argument("--db-batch", type=int, default=64, help="Rows per batched commit")
+    parser.add_argument("--db-url", help="Database to benchmark (default: temporary SQLite file)")
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "plant_disease_model.pth"))
+    parser.add_argument("--output", help="Results JSON (default: microbench_<commit>_<time>.json)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stages = args.stages.split(",")
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"Unknown stages: {', '.join(sorted(unknown))}")
+        sys.exit(2)
+
+    # Must be set before database.py is imported: it builds its engines at import time
+    tmp_dir = None
+    if "db" in stages:
+        if args.db_url:
+            os.environ["DATABASE_URL"] = args.db_url
+        else:
+            tmp_dir = tempfile.TemporaryDirectory()
+            os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir.name, 'bench.db')}"
+
+    from loadtest import PHONE_RESOLUTIONS, git_commit, save_results, synthetic_jpeg
+
+    images = {f"{w}x{h}": synthetic_jpeg(w, h, seed=i) for i, (w, h) in enumerate(PHONE_RESOLUTIONS)}
+    results = {}
+    if "decode" in stages:
+        print("Timing decode...")
+        results["decode"] = bench_decode(images, args.repeat)
+    if "preprocess" in stages:
+        print("Timing preprocess...")
+        results["preprocess"] = bench_preprocess(images, args.repeat)
+    if "forward" in stages:
+        print("Timing forward pass...")
+        results["forward"] = bench_forward([int(b) for b in args.batch_sizes.split(",")], args.repeat, args.model)
+    if "db" in stages:
+        print("Timing DB commit...")
+        results["db"] = asyncio.run(bench_db(args.repeat, args.db_batch))
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    print(json.dumps(results, indent=2))
+    commit = git_commit()
+    report = {
+        "kind": "microbench",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "config": vars(args),
+        "results": results,
+    }
+    output = args.output or f"microbench_{commit or 'nogit'}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    save_results(report, output)
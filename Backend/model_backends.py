@@ -0,0 +1,152 @@
+"""
+Inference Backends
+Loads the ResNet18 classifier as eager PyTorch, a frozen TorchScript module,
+or a statically INT8-quantized TorchScript module
+"""
+
+import os
+
+import torch
+import torch.nn as nn
+from torchvision import models as tv_models
+
+BACKENDS = ("eager", "torchscript", "int8")
+
+# Which backend the server runs; torchscript/int8 need `python export_model.py` first
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "eager")
+# NHWC activations let the oneDNN CPU convolutions skip layout reorders
+MODEL_CHANNELS_LAST = os.getenv("MODEL_CHANNELS_LAST", "1") == "1"
+# Memory-map eager checkpoints and adopt the mapped tensors as the weights (no random init),
+# then copy them into process memory once; pre-fork workers share that copy copy-on-write
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1") == "1"
+# Quantized kernel library; must match the one used at export time
+QUANTIZED_ENGINE = os.getenv("QUANTIZED_ENGINE", "x86")
+
+
+def backend_path(model_path, backend):
+    """plant_disease_model.pth -> plant_disease_model.<backend>.pt for exported backends"""
+    if backend == "eager":
+        return model_path
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.{backend}.pt"
+
+
+def select_quantized_engine(preferred=QUANTIZED_ENGINE):
+    supported = torch.backends.quantized.supported_engines
+    for engine in (preferred, "x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"No quantized engine available (supported: {supported})")
+
+
+def build_resnet18(num_classes, quantizable=False):
+    if quantizable:
+        model = tv_models.quantization.resnet18(weights=None, quantize=False)
+    else:
+        model = tv_models.resnet18(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, num_classes)
+    return model
+
+
+def load_checkpoint(model_path, device, mmap=MODEL_MMAP):
+    if mmap:
+        try:
+            return torch.load(model_path, map_location=device, weights_only=False, mmap=True)
+        except (TypeError, RuntimeError):
+            # torch < 2.1 has no mmap argument; legacy (non-zip) checkpoints can't be mapped
+            pass
+    return torch.load(model_path, map_location=device, weights_only=False)
+
+
+def detach_from_file(model):
+    """Move mapped weights into anonymous memory: a forward pass touching pages of a checkpoint
+    that was rewritten in place (cp, torch.save) would kill the process with SIGBUS"""
+    with torch.no_grad():
+        for tensor in [*model.parameters(), *model.buffers()]:
+            tensor.data = tensor.data.clone()
+    return model
+
+
+def load_eager(model_path, num_classes, device, quantizable=False, mmap=MODEL_MMAP):
+    checkpoint = load_checkpoint(model_path, device, mmap=mmap)
+    state_dict = checkpoint['model_state_dict']
+    model = None
+    if mmap and not quantizable:
+        try:
+            # Skeleton on the meta device: parameters are replaced by the checkpoint tensors
+            with torch.device("meta"):
+                model = build_resnet18(num_classes)
+            model.load_state_dict(state_dict, assign=True)
+            detach_from_file(model)
+        except TypeError:
+            model = None  # torch < 2.1: no assign=, fall back to copying
+    if model is None:
+        model = build_resnet18(num_classes, quantizable=quantizable)
+        model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+def load_model(backend, model_path, num_classes, device):
+    """Load the classifier for the given backend, ready for inference"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown MODEL_BACKEND '{backend}', expected one of {BACKENDS}")
+
+    if backend == "eager":
+        model = load_eager(model_path, num_classes, device)
+        if MODEL_CHANNELS_LAST:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    path = backend_path(model_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{backend} model not found at {path} - run export_model.py")
+    if backend == "int8":
+        select_quantized_engine()
+    model = torch.jit.load(path, map_location=device)
+    model.eval()
+    if backend == "torchscript":
+        # Conv/BN folding and oneDNN layout passes; not serializable, so applied after load
+        model = torch.jit.optimize_for_inference(model)
+    return model
+
+
+def to_torchscript(model, example):
+    """Trace and freeze an eager model into a TorchScript module"""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.freeze(traced)
+
+
+def export_torchscript(model_path, num_classes, output_path):
+    model = load_eager(model_path, num_classes, torch.device("cpu"))
+    model = model.to(memory_format=torch.channels_last)
+    example = torch.randn(1, 3, 224, 224).to(memory_format=torch.channels_last)
+    scripted = to_torchscript(model, example)
+    torch.jit.save(scripted, output_path)
+    return scripted
+
+
+def export_int8(model_path, num_classes, calibration_batches, output_path):
+    """Post-training static quantization: fuse conv/bn/relu, calibrate observers, convert to INT8"""
+    engine = select_quantized_engine()
+
+    model = load_eager(model_path, num_classes, torch.device("cpu"), quantizable=True)
+    model.fuse_model()
+    model.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(model, inplace=True)
+
+    with torch.no_grad():
+        for batch in calibration_batches:
+            model(batch)
+
+    torch.ao.quantization.convert(model, inplace=True)
+
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, output_path)
+    return frozen
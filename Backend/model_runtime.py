@@ -0,0 +1,222 @@
+"""
+Model Runtime
+Loads a checkpoint into everything /predict needs - model, batching engine, class names
+and remedies - times each startup phase, and warms the model up before it takes traffic
+
+Each loaded model carries a version (a content hash of the weights and classes.json), so
+a hot reload can tell whether the files really changed and scan_logs can record which
+model produced every prediction.
+
+torch is only imported inside load_serving_model(), so importing this module (and main.py)
+stays cheap and the server can answer liveness probes while the model loads.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import executor
+
+# Dummy forward passes per warm-up shape (single image and a full batch)
+WARMUP_ROUNDS = int(os.getenv("WARMUP_ROUNDS", "2"))
+# "1": finish loading before the server accepts connections instead of in the background
+MODEL_LOAD_BLOCKING = os.getenv("MODEL_LOAD_BLOCKING", "0") == "1"
+# Seconds clients are told to wait while the model is still loading
+LOADING_RETRY_AFTER = int(os.getenv("LOADING_RETRY_AFTER", "5"))
+
+DEFAULT_REMEDY = "Consult an agronomist for proper treatment."
+# Hex digits of the content hash kept as the model version
+VERSION_LENGTH = 12
+
+
+class ModelLoading(Exception):
+    """Raised for predictions that arrive before the model is warm; the API answers 503"""
+
+    def __init__(self, retry_after=LOADING_RETRY_AFTER):
+        super().__init__("Model is still loading")
+        self.retry_after = retry_after
+
+
+class StartupState:
+    """Readiness and per-phase timings, reported by /ready"""
+
+    def __init__(self):
+        self.phases = {}
+        self.status = "starting"
+        self.error = None
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = round(elapsed * 1000, 1)
+            print(f"   {name}: {elapsed * 1000:.0f} ms")
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def mark_ready(self):
+        self.status = "ready"
+        self.phases["total"] = round((time.perf_counter() - self._started_at) * 1000, 1)
+
+    def mark_failed(self, error):
+        self.status = "failed"
+        self.error = str(error)
+
+    def report(self):
+        return {"status": self.status, "error": self.error, "phases_ms": self.phases}
+
+
+class ServingModel:
+    """A loaded checkpoint with its batching engine and label maps"""
+
+    def __init__(self, model, device, backend, engine, class_names, remedies, version=None):
+        self.model = model
+        self.device = device
+        self.backend = backend
+        self.engine = engine
+        self.class_names = class_names
+        self.remedies = remedies
+        self.version = version
+        # Prediction cache for this model's results; set by main.py, dropped with the model on a reload
+        self.cache = None
+
+        # Requests currently pinned to this model; only touched from the event loop
+        self.in_flight = 0
+        self._drained = None
+
+    @contextmanager
+    def pinned(self):
+        """Count a request against this model, so a reload retires it only once the request is done"""
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0 and self._drained is not None:
+                self._drained.set()
+
+    async def retire(self):
+        """Stop the batching engine after every request pinned to this model has finished"""
+        self._drained = asyncio.Event()
+        if self.in_flight:
+            await self._drained.wait()
+        await self.engine.stop()
+
+    def label(self, probabilities):
+        """Softmax row -> (disease_name, confidence %, remedy)"""
+        confidence, index = probabilities.max(0)
+        disease_name = self.class_names[str(index.item())]
+        return disease_name, round(confidence.item() * 100, 2), self.remedies.get(disease_name, DEFAULT_REMEDY)
+
+    async def predict(self, tensor):
+        return self.label(await self.engine.predict(tensor))
+
+    def predict_batch(self, batch):
+        """Blocking: labels for a whole NCHW batch, bypassing the micro-batching queue (offline scoring)"""
+        import torch
+
+        batch = batch.to(self.device)
+        if self.engine.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            probabilities = torch.nn.functional.softmax(self.model(batch), dim=1).cpu()
+        return [self.label(row) for row in probabilities]
+
+    async def warm_up(self, rounds=WARMUP_ROUNDS):
+        """Run dummy batches so the first real requests don't pay for kernel selection and allocation"""
+        await self.engine.start()
+        await self.engine.warm_up(sorted({1, self.engine.max_batch_size}), rounds)
+
+
+def file_fingerprint(*paths):
+    """(mtime, size) of each path; changes whenever any of the files is replaced"""
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+def checkpoint_version(*paths):
+    """Short content hash of the given files; identical files give the same version on every host"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(hashlib.file_digest(f, "sha256").digest())
+    return digest.hexdigest()[:VERSION_LENGTH]
+
+
+def checkpoint_files(model_path, classes_path):
+    """The files a MODEL_BACKEND load reads: the (exported) weights and classes.json"""
+    import model_backends
+
+    return model_backends.backend_path(model_path, model_backends.MODEL_BACKEND), classes_path
+
+
+def load_weights(model_path, classes_path, state):
+    """Blocking: import torch, read classes.json and load the MODEL_BACKEND model"""
+    with state.phase("import_torch"):
+        import torch
+        import model_backends
+
+    with state.phase("read_classes"):
+        with open(classes_path, 'r') as f:
+            classes_data = json.load(f)
+        class_names = classes_data['class_names']  # Dict with int keys as strings
+        remedies = classes_data['remedies']
+
+    # Eager checkpoints are memory-mapped when torch supports it (see model_backends.MODEL_MMAP)
+    with state.phase("load_weights"):
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        backend = model_backends.MODEL_BACKEND
+        model = model_backends.load_model(backend, model_path, len(class_names), device)
+
+    # Hash of the file the backend actually loaded, so an int8 re-export is a new version too
+    with state.phase("version"):
+        version = checkpoint_version(*checkpoint_files(model_path, classes_path))
+    return model, device, backend, class_names, remedies, version
+
+
+# (model_path, classes_path) -> load_weights() result, set by preload() in a pre-fork parent
+_preloaded = {}
+
+
+def preload(model_path, classes_path, state=None):
+    """Load the weights once before forking; workers then share them instead of loading their own"""
+    loaded = load_weights(model_path, classes_path, state or StartupState())
+    _preloaded[(model_path, classes_path)] = loaded
+    return loaded
+
+
+def load_serving_model(model_path, classes_path, state, reuse_preloaded=True):
+    """Blocking: load (or adopt preloaded) weights and build the batching engine around them
+
+    Hot reloads pass reuse_preloaded=False: the preloaded weights are the ones being replaced.
+    """
+    loaded = _preloaded.get((model_path, classes_path)) if reuse_preloaded else None
+    if loaded is None:
+        loaded = load_weights(model_path, classes_path, state)
+    model, device, backend, class_names, remedies, version = loaded
+
+    import torch
+    import model_backends
+    from batching import BatchInferenceEngine
+
+    # Keep torch's intra-op threads in line with the CPU worker pool
+    torch.set_num_threads(executor.TORCH_THREADS)
+
+    # Micro-batching scheduler shared by all concurrent /predict calls
+    engine = BatchInferenceEngine(model, device, channels_last=model_backends.MODEL_CHANNELS_LAST)
+    return ServingModel(model, device, backend, engine, class_names, remedies, version)
@@ -1,7 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
 from database import Base
 import datetime
 
+def naive_utc(timestamp):
+    """Timestamps are stored as naive UTC: convert aware query bounds (e.g. ...Z) to match"""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
 class ScanLog(Base):
     __tablename__ = "scan_logs"
 
@@ -10,3 +16,30 @@ class ScanLog(Base):
     confidence = Column(Float, nullable=False)
     remedy = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    # ServingModel.version that produced the prediction ("mock" in mock mode, NULL for older rows)
+    model_version = Column(String, nullable=True)
+
+    # Back the newest-first keyset pagination in /history, with and without a disease filter
+    __table_args__ = (
+        Index("ix_scan_logs_timestamp_id", "timestamp", "id"),
+        Index("ix_scan_logs_disease_timestamp_id", "disease_name", "timestamp", "id"),
+    )
+
+class DiseaseRollup(Base):
+    """Running totals per disease, maintained alongside every ScanLog insert"""
+    __tablename__ = "disease_rollups"
+
+    disease_name = Column(String, primary_key=True)
+    scan_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+
+class DiseaseTrendRollup(Base):
+    """Per-disease count and confidence sum per hour and per day, maintained alongside every ScanLog insert"""
+    __tablename__ = "disease_trend_rollups"
+
+    # "hour" or "day"; week and month trends are summed from the day rows
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    disease_name = Column(String, primary_key=True)
+    scan_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
@@ -0,0 +1,125 @@
+"""
+Content-Addressed Prediction Cache
+Skips decode, resize and the forward pass for uploads we have already scored
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE", "1") == "1"
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+PREDICTION_CACHE_MAX_MB = float(os.getenv("PREDICTION_CACHE_MAX_MB", "32"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+# Second tier keyed on a perceptual hash, catches re-encoded/resized copies of the same photo
+PREDICTION_CACHE_PERCEPTUAL = os.getenv("PREDICTION_CACHE_PERCEPTUAL", "0") == "1"
+
+
+def content_key(image_data):
+    """Exact-match key: hash of the raw upload bytes, or of a binary upload file read in chunks"""
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return "sha256:" + hashlib.sha256(image_data).hexdigest()
+    image_data.seek(0)
+    return "sha256:" + hashlib.file_digest(image_data, "sha256").hexdigest()
+
+
+def perceptual_key(image):
+    """Near-match key: 64-bit difference hash of a decoded PIL image"""
+    small = image.convert("L").resize((9, 8))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"dhash:{bits:016x}"
+
+
+class PredictionCache:
+    """LRU cache bounded by entry count and approximate memory, with a TTL"""
+
+    def __init__(
+        self,
+        max_entries=PREDICTION_CACHE_MAX_ENTRIES,
+        max_bytes=int(PREDICTION_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds=PREDICTION_CACHE_TTL,
+        perceptual=PREDICTION_CACHE_PERCEPTUAL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.perceptual = perceptual
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if key is None:
+            return
+        size = sys.getsizeof(key) + sum(sys.getsizeof(v) for v in value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "perceptual": self.perceptual,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
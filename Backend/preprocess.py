@@ -0,0 +1,148 @@
+"""
+Serving Image Preprocessing
+Fast decode + resize + normalize path that replaces the torchvision Compose
+
+Usage:
+    python preprocess.py --parity img1.jpg img2.jpg ...   # compare against the training transform
+    python preprocess.py --bench img1.jpg img2.jpg ...    # per-image decode+preprocess timing
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+import uploads
+
+IMAGE_SIZE = 224
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+# Largest mean |difference| from the training transform that --parity (and tests/) accept
+PARITY_TOLERANCE = 0.05
+
+# JPEG draft mode: let libjpeg decode at 1/2, 1/4 or 1/8 scale when the photo is much larger than 224px
+FAST_DECODE = os.getenv("FAST_DECODE", "1") == "1"
+# Keep at least this many times the model size after draft decoding, so the final
+# bilinear resize still averages enough pixels to match the training transform
+DRAFT_OVERSAMPLE = 2
+
+# Folded normalization: (x / 255 - mean) / std == x * scale - shift
+_SCALE = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(3, 1, 1)
+_SHIFT = torch.tensor([m / s for m, s in zip(MEAN, STD)]).view(3, 1, 1)
+
+# One reusable HWC uint8 buffer per worker thread
+_buffers = threading.local()
+
+
+def decode(image_data, size=IMAGE_SIZE, fast=FAST_DECODE, max_pixels=None):
+    """Decode upload bytes (or a binary file) to an RGB PIL image, at reduced resolution when the format allows it"""
+    # Only the header is read here, so oversize images are refused before decoding
+    image = uploads.open_image(image_data, max_pixels)
+    if fast and image.format == "JPEG":
+        # Picks the smallest DCT scale that still keeps both sides >= size * DRAFT_OVERSAMPLE
+        image.draft("RGB", (size * DRAFT_OVERSAMPLE, size * DRAFT_OVERSAMPLE))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def _buffer(size):
+    buffer = getattr(_buffers, "array", None)
+    if buffer is None or buffer.shape[0] != size:
+        buffer = np.empty((size, size, 3), dtype=np.uint8)
+        _buffers.array = buffer
+    return buffer
+
+
+def to_tensor(image, size=IMAGE_SIZE):
+    """Resize into the thread's uint8 buffer and normalize in one pass; returns a CHW float tensor"""
+    buffer = _buffer(size)
+    resized = image.resize((size, size), Image.BILINEAR)
+    np.copyto(buffer, np.asarray(resized))
+
+    # float() allocates the returned tensor, so the buffer is free for the next image
+    tensor = torch.from_numpy(buffer).permute(2, 0, 1).float()
+    return tensor.mul_(_SCALE).sub_(_SHIFT)
+
+
+def preprocess(image_data, size=IMAGE_SIZE):
+    return to_tensor(decode(image_data, size), size)
+
+
+def resize_array(image, size=IMAGE_SIZE):
+    """Resize to an HWC uint8 array: a quarter of the float tensor's size to pass between processes"""
+    return np.asarray(image.resize((size, size), Image.BILINEAR), dtype=np.uint8)
+
+
+def normalize(arrays):
+    """Stack HWC uint8 arrays from resize_array() into a normalized NCHW float batch, like to_tensor()"""
+    batch = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).float()
+    return batch.mul_(_SCALE).sub_(_SHIFT)
+
+
+# -------------------- PARITY CHECK AND BENCHMARK --------------------
+
+def reference_transform():
+    """The eval transform from train_model.py"""
+    from torchvision import transforms
+
+    return transforms.Compose([
+        transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN, STD)
+    ])
+
+
+def check_parity(paths, max_mean_abs_diff=PARITY_TOLERANCE):
+    """Compare the fast path with the training transform; returns True when every image is within tolerance"""
+    transform = reference_transform()
+    ok = True
+    for path in paths:
+        with open(path, "rb") as f:
+            image_data = f.read()
+        expected = transform(Image.open(io.BytesIO(image_data)).convert("RGB"))
+        actual = preprocess(image_data)
+
+        diff = (actual - expected).abs()
+        mean_diff = diff.mean().item()
+        passed = actual.shape == expected.shape and mean_diff <= max_mean_abs_diff
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {path}: mean |diff| {mean_diff:.4f}, max |diff| {diff.max().item():.4f}")
+    return ok
+
+
+def benchmark(paths, repeat=10):
+    """Per-image decode+preprocess time of the fast path vs the torchvision Compose"""
+    transform = reference_transform()
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    def baseline(image_data):
+        return transform(Image.open(io.BytesIO(image_data)).convert("RGB"))
+
+    for name, fn in (("torchvision Compose", baseline), ("fast path", preprocess)):
+        fn(images[0])  # warm-up
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for image_data in images:
+                fn(image_data)
+        per_image = (time.perf_counter() - start) / (repeat * len(images))
+        print(f"{name:>20}: {per_image * 1000:.2f} ms/image")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("--parity", "--bench"):
+        print(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == "--parity":
+        sys.exit(0 if check_parity(sys.argv[2:]) else 1)
+    benchmark(sys.argv[2:])
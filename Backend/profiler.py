@@ -0,0 +1,110 @@
+"""
+On-demand Sampling Profiler
+Samples every thread's Python stack at a fixed interval while armed, for the next N
+requests, and returns the result as collapsed stacks (flamegraph.pl / speedscope input)
+
+Nothing runs until a capture is armed: no thread, no hooks, so the idle cost is zero.
+Enabled with PROFILER_ENABLED=1, which exposes POST/GET /debug/profile.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Stop a capture that is still waiting for requests after this many seconds
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Requests to these paths don't count towards a capture
+IGNORED_PREFIXES = ("/metrics", "/debug")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = Counter()
+        self._remaining = 0
+        self._started_at = 0.0
+        self._requests = 0
+        self.result = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def arm(self, requests, interval_ms=PROFILE_INTERVAL_MS, max_seconds=PROFILE_MAX_SECONDS):
+        """Start sampling; the capture ends after `requests` requests or `max_seconds`"""
+        with self._lock:
+            if self._thread is not None:
+                raise ProfilerBusy("A capture is already running")
+            self._stacks = Counter()
+            self._remaining = max(1, requests)
+            self._requests = 0
+            self._started_at = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample_loop, args=(interval_ms / 1000.0, max_seconds),
+                name="sampling-profiler", daemon=True,
+            )
+            self._thread.start()
+
+    def request_done(self, path):
+        """Called for every finished request; cheap no-op while no capture is armed"""
+        if self._thread is None or path.startswith(IGNORED_PREFIXES):
+            return
+        with self._lock:
+            self._requests += 1
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._stop.set()
+
+    def _sample_loop(self, interval, max_seconds):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + max_seconds
+        samples = 0
+        while not self._stop.wait(interval) and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(stack))] += 1
+            samples += 1
+        self._finish(samples)
+
+    def _finish(self, samples):
+        with self._lock:
+            self.result = {
+                "requests": self._requests,
+                "samples": samples,
+                "duration_s": round(time.monotonic() - self._started_at, 3),
+                "collapsed": "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()),
+            }
+            self._thread = None
+
+    def stop(self):
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+
+profiler = SamplingProfiler()
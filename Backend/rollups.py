@@ -0,0 +1,224 @@
+"""
+Analytics Rollups
+Per-disease count and confidence sum, all-time and per hour/day bucket, updated in the
+same transaction as the ScanLog insert so /analytics and /analytics/trends read rollup
+rows instead of scanning scan_logs
+
+Usage:
+    python rollups.py --rebuild           # backfill/rebuild all rollups from existing scan_logs
+    python rollups.py --rebuild-trends    # only the hour/day trend buckets
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import exc, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+import database
+import models
+import trends
+
+# Seconds an /analytics response may be served from memory
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "2"))
+# scan_logs rows fetched per round trip when rebuilding the trend rollups
+TREND_REBUILD_CHUNK = 50000
+
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE; others use add_to_rollup()
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def disease_values(rows):
+    """disease_rollups rows holding the count and confidence sum of a batch of ScanLog rows"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        total = totals[row["disease_name"]]
+        total[0] += 1
+        total[1] += row["confidence"]
+    return [
+        {"disease_name": name, "scan_count": count, "confidence_sum": confidence_sum}
+        for name, (count, confidence_sum) in totals.items()
+    ]
+
+
+def trend_totals(rows, totals=None):
+    """Add (timestamp, disease_name, confidence) rows to {(granularity, bucket_start, disease): [count, sum]}"""
+    if totals is None:
+        totals = defaultdict(lambda: [0, 0.0])
+    for timestamp, disease_name, confidence in rows:
+        for granularity in trends.STORED_GRANULARITIES:
+            total = totals[(granularity, trends.bucket_start(timestamp, granularity), disease_name)]
+            total[0] += 1
+            total[1] += confidence
+    return totals
+
+
+def trend_values(totals):
+    return [
+        {"granularity": granularity, "bucket_start": start, "disease_name": name,
+         "scan_count": count, "confidence_sum": confidence_sum}
+        for (granularity, start, name), (count, confidence_sum) in totals.items()
+    ]
+
+
+def in_key_order(table, values):
+    """values sorted by primary key: concurrent flushes then lock shared rollup rows in the same
+    order, instead of deadlocking (and aborting a transaction with its scans) on PostgreSQL"""
+    keys = [column.name for column in table.__table__.primary_key.columns]
+    return sorted(values, key=lambda value: tuple(value[key] for key in keys))
+
+
+def rollup_upsert(dialect_name, table, values):
+    """INSERT ... ON CONFLICT DO UPDATE adding values to the counters of their rollup rows"""
+    stmt = UPSERT_INSERTS[dialect_name](table).values(in_key_order(table, values))
+    return stmt.on_conflict_do_update(
+        index_elements=list(table.__table__.primary_key.columns),
+        set_={
+            "scan_count": table.scan_count + stmt.excluded.scan_count,
+            "confidence_sum": table.confidence_sum + stmt.excluded.confidence_sum,
+        },
+    )
+
+
+async def add_to_rollup(db, table, values):
+    """Portable fallback: UPDATE each rollup row's counters, INSERT the rows that don't exist yet"""
+    keys = [column.name for column in table.__table__.primary_key.columns]
+    for value in in_key_order(table, values):
+        increment = (
+            update(table)
+            .where(*(getattr(table, key) == value[key] for key in keys))
+            .values(scan_count=table.scan_count + value["scan_count"],
+                    confidence_sum=table.confidence_sum + value["confidence_sum"])
+        )
+        if (await db.execute(increment)).rowcount:
+            continue
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(table).values(value))
+        except exc.IntegrityError:
+            # Another transaction created the row in the meantime
+            await db.execute(increment)
+
+
+async def apply_rollups(db, rows):
+    """Add a batch of ScanLog rows to the rollups; the caller commits with the inserts"""
+    dialect_name = db.bind.dialect.name
+    updates = (
+        (models.DiseaseRollup, disease_values(rows)),
+        (models.DiseaseTrendRollup,
+         trend_values(trend_totals((row["timestamp"], row["disease_name"], row["confidence"]) for row in rows))),
+    )
+    for table, values in updates:
+        if dialect_name in UPSERT_INSERTS:
+            await db.execute(rollup_upsert(dialect_name, table, values))
+        else:
+            await add_to_rollup(db, table, values)
+
+
+async def disease_totals(db):
+    """[(disease_name, scan_count, confidence_sum)] from the rollup table"""
+    rollup = models.DiseaseRollup
+    result = await db.execute(select(rollup.disease_name, rollup.scan_count, rollup.confidence_sum))
+    return result.all()
+
+
+def rebuild_rollups(db):
+    """Recompute the rollups from scan_logs; run with writers paused for an exact result"""
+    rollup = models.DiseaseRollup
+    db.query(rollup).delete(synchronize_session=False)
+    aggregates = db.query(
+        models.ScanLog.disease_name,
+        func.count(models.ScanLog.id),
+        func.coalesce(func.sum(models.ScanLog.confidence), 0.0)
+    ).group_by(models.ScanLog.disease_name).all()
+    db.add_all([
+        rollup(disease_name=name, scan_count=count, confidence_sum=confidence_sum)
+        for name, count, confidence_sum in aggregates
+    ])
+    db.commit()
+    return len(aggregates)
+
+
+def rebuild_trend_rollups(db, chunk_size=TREND_REBUILD_CHUNK):
+    """Recompute the hour/day trend buckets from scan_logs, streaming it in chunks; returns (scans, buckets)"""
+    trend = models.DiseaseTrendRollup
+    db.query(trend).delete(synchronize_session=False)
+
+    scan = models.ScanLog
+    result = db.execute(
+        select(scan.timestamp, scan.disease_name, scan.confidence)
+        .where(scan.timestamp.is_not(None))
+        .execution_options(yield_per=chunk_size)
+    )
+    # Memory grows with the number of buckets x diseases, not with the number of scans
+    totals = defaultdict(lambda: [0, 0.0])
+    scans = 0
+    for rows in result.partitions():
+        trend_totals(rows, totals)
+        scans += len(rows)
+
+    values = trend_values(totals)
+    for i in range(0, len(values), chunk_size):
+        db.execute(insert(trend), values[i:i + chunk_size])
+    db.commit()
+    return scans, len(values)
+
+
+def ensure_rollups(db):
+    """Backfill once for databases created before the rollup tables existed"""
+    if db.query(models.ScanLog).first() is None:
+        return
+    if db.query(models.DiseaseRollup).first() is None:
+        print("⚠️ Rollups empty but scan_logs has data - rebuilding")
+        rebuild_rollups(db)
+    if db.query(models.DiseaseTrendRollup).first() is None:
+        print("⚠️ Trend rollups empty but scan_logs has data - rebuilding")
+        rebuild_trend_rollups(db)
+
+
+class TTLCache:
+    """Single-value cache that expires after ttl_seconds"""
+
+    def __init__(self, ttl_seconds=ANALYTICS_CACHE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._value = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires_at:
+                return self._value
+            return None
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+            self._expires_at = time.monotonic() + self.ttl_seconds
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["--rebuild"], ["--rebuild-trends"]):
+        print(__doc__)
+        sys.exit(2)
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        if sys.argv[1] == "--rebuild":
+            start = time.perf_counter()
+            count = rebuild_rollups(db)
+            print(f"✅ Rebuilt rollups for {count} diseases in {time.perf_counter() - start:.2f}s")
+        start = time.perf_counter()
+        scans, buckets = rebuild_trend_rollups(db)
+        print(f"✅ Rebuilt {buckets} trend buckets from {scans} scans in {time.perf_counter() - start:.2f}s")
+    finally:
+        db.close()
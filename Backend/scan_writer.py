@@ -0,0 +1,177 @@
+"""
+ScanLog Persistence
+Write-through (default) or write-behind buffered inserts for models.ScanLog
+"""
+
+import asyncio
+import datetime
+import os
+import time
+
+from sqlalchemy import exc, insert
+
+import database
+import executor
+import metrics
+import models
+import rollups
+
+# "sync": every request waits for its own commit. "write_behind": requests enqueue, a background task bulk-inserts
+SCAN_LOG_MODE = os.getenv("SCAN_LOG_MODE", "sync")
+SCAN_LOG_QUEUE_SIZE = int(os.getenv("SCAN_LOG_QUEUE_SIZE", "10000"))
+SCAN_LOG_FLUSH_SIZE = int(os.getenv("SCAN_LOG_FLUSH_SIZE", "200"))
+SCAN_LOG_FLUSH_MS = float(os.getenv("SCAN_LOG_FLUSH_MS", "250"))
+# Seconds a flush keeps retrying while the DB pool is exhausted before dropping its rows (also bounds shutdown)
+SCAN_LOG_RETRY_SECONDS = float(os.getenv("SCAN_LOG_RETRY_SECONDS", "30"))
+
+
+def scan_log_row(disease_name, confidence, remedy, model_version=None):
+    # Timestamp at scan time, not at (possibly delayed) insert time
+    return {
+        "disease_name": disease_name,
+        "confidence": confidence,
+        "remedy": remedy,
+        "timestamp": datetime.datetime.utcnow(),
+        "model_version": model_version,
+    }
+
+
+async def save_scan_logs(rows):
+    # Own session: write-behind flushes and streaming responses outlive request-scoped sessions
+    with metrics.stage("db_commit"):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(insert(models.ScanLog), rows)
+            # Same transaction, so /analytics never sees scans without their rollup
+            await rollups.apply_rollups(db, rows)
+            await db.commit()
+
+
+class ScanLogWriter:
+    """Persists ScanLog rows either synchronously or through a bounded write-behind queue"""
+
+    def __init__(self, mode=SCAN_LOG_MODE, queue_size=SCAN_LOG_QUEUE_SIZE,
+                 flush_size=SCAN_LOG_FLUSH_SIZE, flush_ms=SCAN_LOG_FLUSH_MS, retry_seconds=SCAN_LOG_RETRY_SECONDS):
+        if mode not in ("sync", "write_behind"):
+            raise ValueError(f"Unknown SCAN_LOG_MODE '{mode}', expected 'sync' or 'write_behind'")
+        self.mode = mode
+        self.queue_size = queue_size
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.retry_seconds = retry_seconds
+
+        self._queue = None
+        self._worker = None
+        # Rows taken off the queue but not yet handed to a flush, and the flush in progress
+        self._batch = []
+        self._flushing = None
+
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    async def start(self):
+        if self.mode == "write_behind" and self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task, then drain and flush everything still queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+
+        rows, self._batch = self._batch, []
+        while not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        # One retry deadline for the whole drain, so an unreachable DB can't hang shutdown
+        deadline = time.monotonic() + self.retry_seconds
+        for start in range(0, len(rows), self.flush_size):
+            flushed = await self._flush(rows[start:start + self.flush_size], deadline)
+            if not flushed and time.monotonic() >= deadline:
+                remaining = rows[start + self.flush_size:]
+                self.dropped += len(remaining)
+                if remaining:
+                    print(f"⚠️ Shutting down without the database, dropped {len(remaining)} more records")
+                return
+
+    async def record(self, row):
+        await self.record_many([row])
+
+    async def record_many(self, rows):
+        if not rows:
+            return
+        if self.mode == "sync":
+            await save_scan_logs(rows)
+            self.written += len(rows)
+            return
+
+        if self._worker is None:
+            await self.start()
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except asyncio.QueueFull:
+                # Never block a request on the log backlog; count what we lose instead
+                self.dropped += 1
+
+    async def _flush(self, rows, deadline=None):
+        """Insert rows, retrying while the pool is exhausted; False if they had to be dropped"""
+        start = time.perf_counter()
+        if deadline is None:
+            deadline = time.monotonic() + self.retry_seconds
+        while True:
+            try:
+                await save_scan_logs(rows)
+                break
+            except exc.TimeoutError as e:
+                if time.monotonic() >= deadline:
+                    error = e
+                else:
+                    # Request traffic holds every pooled connection; back off and retry the same rows
+                    await asyncio.sleep(self.flush_interval or 0.05)
+                    continue
+            except Exception as e:
+                error = e
+            self.failed_flushes += 1
+            self.dropped += len(rows)
+            print(f"⚠️ ScanLog flush failed, dropped {len(rows)} records: {error}")
+            return False
+
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.written += len(rows)
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        return True
+
+    async def _run(self):
+        while True:
+            # Collects into self._batch, so a shutdown mid-collect can still flush these rows
+            rows = await executor.collect_batch(self._queue, self.flush_size, self.flush_interval, self._batch)
+            self._batch = []
+            # Shielded so a shutdown mid-flush waits for it instead of abandoning the rows
+            self._flushing = asyncio.ensure_future(self._flush(rows))
+            await asyncio.shield(self._flushing)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size if self.mode == "write_behind" else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "flush_ms_mean": round(self.flush_seconds_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+            "flush_ms_max": round(self.flush_seconds_max * 1000, 2),
+        }
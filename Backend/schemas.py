@@ -6,6 +6,11 @@ class PredictionResponse(BaseModel):
     disease_name: str
     confidence: float
     remedy: str
+    model_version: Optional[str] = None
+
+    class Config:
+        # Older pydantic 2.x warns about fields starting with "model_"
+        protected_namespaces = ()
 
 class PredictionHistoryResponse(BaseModel):
     id: int
@@ -13,9 +18,11 @@ class PredictionHistoryResponse(BaseModel):
     confidence: float
     remedy: str
     timestamp: datetime
+    model_version: Optional[str] = None
 
     class Config:
         from_attributes = True
+        protected_namespaces = ()
 
 class DiseaseStats(BaseModel):
     disease_name: str
@@ -27,3 +34,26 @@ class AnalyticsResponse(BaseModel):
     disease_distribution: List[DiseaseStats]
     most_common_disease: Optional[str]
     average_confidence: float
+
+class BatchPredictionResponse(PredictionResponse):
+    filename: str
+
+class BatchPredictionError(BaseModel):
+    filename: str
+    error: str
+
+class TrendPoint(BaseModel):
+    disease_name: str
+    count: int
+    average_confidence: float
+
+class TrendBucket(BaseModel):
+    bucket_start: datetime
+    total: int
+    diseases: List[TrendPoint]
+
+class TrendsResponse(BaseModel):
+    bucket: str
+    start: datetime
+    end: datetime
+    buckets: List[TrendBucket]
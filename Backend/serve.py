@@ -0,0 +1,326 @@
+"""
+Pre-fork Server
+Loads the model once in a parent process, then forks uvicorn workers that share its
+weights copy-on-write and split the host's cores between their torch thread pools
+
+Usage:
+    python serve.py --workers 4                 # serve main.py on 0.0.0.0:8000
+    python serve.py --scaling 1,2,4 --duration 20
+    kill -USR1 <parent pid>                     # print resident vs shared memory per worker
+
+--scaling load tests `uvicorn main:app --workers N` (one model copy per worker, every worker
+using all cores) against this launcher for each N, and reports throughput and memory.
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# uvicorn's own convention for the worker count
+SERVE_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Seconds to wait before re-forking a worker that exited on its own
+RESPAWN_DELAY = float(os.getenv("RESPAWN_DELAY", "1"))
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def host_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# -------------------- MEMORY --------------------
+
+def process_memory(pid):
+    """Resident memory split into shared and private pages, in MB (Linux /proc only)"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                parts = rest.split()
+                if len(parts) == 2 and parts[1] == "kB":
+                    fields[key] = int(parts[0])
+    except OSError:
+        return None
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        "rss_mb": mb(fields.get("Rss", 0)),
+        # Proportional share: shared pages divided by the number of processes mapping them
+        "pss_mb": mb(fields.get("Pss", 0)),
+        "shared_mb": mb(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)),
+        "private_mb": mb(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)),
+    }
+
+
+def descendant_pids(pid):
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # The command name may contain spaces; the parent pid follows the closing paren
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+
+    found, pending = [], [pid]
+    while pending:
+        children = parents.get(pending.pop(), [])
+        found.extend(children)
+        pending.extend(children)
+    return sorted(found)
+
+
+def memory_report(parent_pid, worker_pids):
+    processes = {"parent": process_memory(parent_pid)}
+    processes.update({f"worker {pid}": process_memory(pid) for pid in worker_pids})
+    processes = {name: usage for name, usage in processes.items() if usage is not None}
+    return {
+        "processes": processes,
+        # Sum of PSS is the real footprint of the whole process tree
+        "total_pss_mb": round(sum(usage["pss_mb"] for usage in processes.values()), 1),
+    }
+
+
+def print_memory_report(report):
+    print(f"{'process':>14} {'rss MB':>8} {'shared MB':>10} {'private MB':>11} {'pss MB':>8}")
+    for name, usage in report["processes"].items():
+        print(f"{name:>14} {usage['rss_mb']:>8.1f} {usage['shared_mb']:>10.1f} "
+              f"{usage['private_mb']:>11.1f} {usage['pss_mb']:>8.1f}")
+    print(f"{'total pss':>14} {report['total_pss_mb']:>8.1f}")
+
+
+# -------------------- PRE-FORK LAUNCHER --------------------
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level):
+    """Child side of the fork: serve app on the inherited socket until told to stop"""
+    import uvicorn
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+        signal.signal(sig, signal.SIG_DFL)
+    random.seed()  # Don't replay the parent's random stream in every worker
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def preload_app():
+    """Import main.py and load the model in the parent, before any worker exists"""
+    import database
+    import main
+    import model_runtime
+
+    # Table creation runs once here; SETUP_DATABASE=0 keeps the workers from racing to repeat it
+    main.setup_database()
+    database.engine.dispose()
+
+    if main.USE_MOCK:
+        print("USE_MOCK=1 - workers will serve mock predictions")
+    elif os.path.exists(main.MODEL_PATH) and os.path.exists(main.CLASSES_PATH):
+        state = model_runtime.StartupState()
+        try:
+            model_runtime.preload(main.MODEL_PATH, main.CLASSES_PATH, state)
+            print(f"✅ Model loaded once for all workers in {sum(state.phases.values()):.0f} ms")
+        except Exception as e:
+            # Each worker retries on its own and falls back to mock predictions if that fails too
+            print(f"⚠️ Preloading the model failed ({e}) - workers will load it themselves")
+    return main.app
+
+
+def serve(workers, host, port, threads, log_level):
+    # Read by executor.py and main.py at import time, so they must be set before main.py is imported
+    os.environ["CPU_WORKERS"] = os.environ["TORCH_THREADS"] = str(threads)
+    os.environ["SETUP_DATABASE"] = "0"
+
+    sock = bind_socket(host, port)
+    app = preload_app()
+
+    # Objects that exist now are never touched by the collector again, so forked workers
+    # don't dirty (and privately copy) the pages holding them
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock, log_level)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(signum, frame):
+        print_memory_report(memory_report(os.getpid(), sorted(children)))
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, report)
+
+    print(f"Starting {workers} workers on {host}:{port}, {threads} torch threads each "
+          f"({host_cores()} cores), parent pid {os.getpid()}")
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            print(f"⚠️ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)} - restarting")
+            time.sleep(RESPAWN_DELAY)
+            spawn(slot)
+    sock.close()
+
+
+# -------------------- SCALING REPORT --------------------
+
+def launch_command(mode, workers, port):
+    if mode == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--log-level", "warning"]
+    return [sys.executable, os.path.abspath(__file__), "--workers", str(workers), "--host", "127.0.0.1",
+            "--port", str(port), "--log-level", "warning"]
+
+
+def wait_ready(url, process, workers, timeout=300):
+    """Wait until /ready answers 200 on enough fresh connections to have reached every worker"""
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+        try:
+            ok = httpx.get(url + "/ready", timeout=2).status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if streak >= 4 * workers:
+            return
+        time.sleep(0.1 if ok else 0.5)
+    raise RuntimeError(f"Server was not ready within {timeout}s")
+
+
+def scaling_run(mode, workers, images, args):
+    from loadtest import free_port, run_load, stop_server
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(launch_command(mode, workers, port), cwd=BACKEND_DIR)
+    try:
+        started = time.perf_counter()
+        wait_ready(url, process, workers)
+        ready_s = time.perf_counter() - started
+        # Unique uploads: every request pays for decode and forward, not a cache lookup
+        load = asyncio.run(run_load(url, {"predict": 1}, images, args.concurrency, args.duration,
+                                    args.warmup, 0, True, args.timeout))
+        memory = memory_report(process.pid, descendant_pids(process.pid))
+    finally:
+        stop_server(process)
+
+    overall = load["overall"]
+    return {
+        "ready_s": round(ready_s, 2),
+        "throughput_rps": overall["throughput_rps"],
+        "p50_ms": overall.get("p50_ms", 0.0),
+        "p95_ms": overall.get("p95_ms", 0.0),
+        "error_rate": overall["error_rate"],
+        "total_pss_mb": memory["total_pss_mb"],
+        "memory": memory["processes"],
+    }
+
+
+def scaling_report(worker_counts, args):
+    from loadtest import git_commit, save_results, synthetic_images
+
+    images = synthetic_images(args.images, args.image_dir)
+    results = {}
+    for mode in ("uvicorn", "prefork"):
+        for workers in worker_counts:
+            print(f"Load testing {mode} with {workers} workers...")
+            results.setdefault(mode, {})[f"workers_{workers}"] = scaling_run(mode, workers, images, args)
+
+    print(f"\n{'mode':>8} {'workers':>8} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} "
+          f"{'ready s':>8} {'total pss MB':>13}")
+    for mode, runs in results.items():
+        for name, run in runs.items():
+            print(f"{mode:>8} {name.split('_')[1]:>8} {run['throughput_rps']:>8.1f} {run['p50_ms']:>8.1f} "
+                  f"{run['p95_ms']:>8.1f} {100 * run['error_rate']:>6.1f}% {run['ready_s']:>8.1f} "
+                  f"{run['total_pss_mb']:>13.1f}")
+
+    commit = git_commit()
+    report = {
+        "kind": "serve_scaling",
+        "commit": commit,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "host_cores": host_cores(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    output = args.output or f"serve_scaling_{commit or 'nogit'}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    save_results(report, output)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-fork multi-worker server for the Smart Farming API")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Worker processes (default: $WEB_CONCURRENCY or 1)")
+    parser.add_argument("--threads", type=int, help="Torch/CPU threads per worker (default: cores / workers)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--scaling", help="Comma-separated worker counts to benchmark instead of serving")
+    parser.add_argument("--concurrency", type=int, default=16, help="Load test clients (--scaling)")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds per run (--scaling)")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds per run (--scaling)")
+    parser.add_argument("--images", type=int, default=6, help="Distinct synthetic JPEGs (--scaling)")
+    parser.add_argument("--image-dir", help="Cache the synthetic JPEGs here between runs (--scaling)")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout (--scaling)")
+    parser.add_argument("--output", help="Scaling results JSON (default: serve_scaling_<commit>_<time>.json)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.scaling:
+        scaling_report([int(n) for n in args.scaling.split(",")], args)
+    else:
+        workers = max(1, args.workers)
+        serve(workers, args.host, args.port, args.threads or max(1, host_cores() // workers), args.log_level)
@@ -0,0 +1,45 @@
+import asyncio
+import datetime
+
+import pytest
+
+import database
+import history
+import models
+
+
+@pytest.fixture(scope="module", autouse=True)
+def scans():
+    models.Base.metadata.create_all(bind=database.engine)
+    with database.SessionLocal() as db:
+        db.query(models.ScanLog).delete()
+        db.add_all([
+            models.ScanLog(disease_name="Apple_Scab", confidence=90.0, remedy="r",
+                           timestamp=datetime.datetime(2024, 5, 1, hour))
+            for hour in (0, 1, 2)
+        ])
+        db.commit()
+
+
+def query_hours(**kwargs):
+    async def run():
+        async with database.AsyncSessionLocal() as db:
+            rows, _ = await history.query_history(db, 50, **kwargs)
+        await database.async_engine.dispose()
+        return [row["timestamp"].hour for row in rows]
+    return asyncio.run(run())
+
+
+def test_z_suffixed_bounds():
+    start = datetime.datetime.fromisoformat("2024-05-01T01:00:00Z")
+    end = datetime.datetime.fromisoformat("2024-05-01T02:00:00Z")
+    assert query_hours(start=start, end=end) == [1]
+
+
+def test_offset_bounds_are_compared_in_utc():
+    start = datetime.datetime.fromisoformat("2024-05-01T03:00:00+02:00")
+    assert query_hours(start=start) == [2, 1]
+
+
+def test_naive_bounds_are_utc():
+    assert query_hours(end=datetime.datetime(2024, 5, 1, 1)) == [0]
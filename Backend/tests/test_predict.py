@@ -0,0 +1,41 @@
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import exc
+
+# Read by main.py at import time: no model needed to exercise the endpoint
+os.environ["USE_MOCK"] = "1"
+
+import main
+import scan_writer
+
+
+def jpeg_bytes(size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 160, 60)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_predict(client):
+    response = client.post("/predict", files={"file": ("leaf.jpg", jpeg_bytes(), "image/jpeg")})
+    assert response.status_code == 200
+    assert response.json()["model_version"] == main.MOCK_VERSION
+
+
+def test_db_pool_timeout_is_503(client, monkeypatch):
+    async def pool_exhausted(rows):
+        raise exc.TimeoutError("QueuePool limit reached")
+
+    monkeypatch.setattr(scan_writer, "save_scan_logs", pool_exhausted)
+    response = client.post("/predict", files={"file": ("leaf.jpg", jpeg_bytes(), "image/jpeg")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(main.executor.RETRY_AFTER_SECONDS)
@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import preprocess
+
+
+def photo_jpeg(width=3000, height=2000):
+    """Phone-size JPEG with smooth gradients and mild texture, like a leaf photo"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    red = 120 + 80 * np.sin(x / 310) * np.cos(y / 270)
+    green = 150 + 60 * np.cos(x / 190 + y / 420)
+    blue = 60 + 40 * np.sin((x + y) / 530)
+    texture = np.random.default_rng(0).normal(0, 6, (height, width))
+    pixels = np.stack([red, green, blue], axis=-1) + texture[..., None]
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def image_data():
+    return photo_jpeg()
+
+
+@pytest.fixture(scope="module")
+def expected(image_data):
+    return preprocess.reference_transform()(Image.open(io.BytesIO(image_data)).convert("RGB"))
+
+
+@pytest.mark.parametrize("fast", [True, False], ids=["draft", "full"])
+def test_decode_paths_match_training_transform(image_data, expected, fast):
+    image = preprocess.decode(image_data, fast=fast)
+    # The draft path must really decode at reduced scale, or this test isn't exercising it
+    assert (image.width < 3000) == fast
+
+    actual = preprocess.to_tensor(image)
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().mean().item() <= preprocess.PARITY_TOLERANCE
+
+
+def test_preprocess_matches_training_transform(image_data, expected):
+    actual = preprocess.preprocess(image_data)
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().mean().item() <= preprocess.PARITY_TOLERANCE
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import select
+
+import database
+import models
+import rollups
+
+
+def scan_rows(*diseases):
+    timestamp = datetime.datetime(2024, 5, 1, 10, 30)
+    return [{"disease_name": name, "confidence": 80.0, "timestamp": timestamp} for name in diseases]
+
+
+def apply_twice(rows):
+    """Apply rows to empty rollups twice (insert, then increment); returns both rollup tables"""
+    async def run():
+        async with database.AsyncSessionLocal() as db:
+            for table in (models.DiseaseRollup, models.DiseaseTrendRollup):
+                await db.execute(table.__table__.delete())
+            for _ in range(2):
+                await rollups.apply_rollups(db, rows)
+            await db.commit()
+            diseases = (await db.execute(select(
+                models.DiseaseRollup.disease_name, models.DiseaseRollup.scan_count, models.DiseaseRollup.confidence_sum,
+            ))).all()
+            buckets = (await db.execute(select(
+                models.DiseaseTrendRollup.granularity, models.DiseaseTrendRollup.disease_name,
+                models.DiseaseTrendRollup.scan_count,
+            ))).all()
+        await database.async_engine.dispose()
+        return sorted(diseases), sorted(buckets)
+    return asyncio.run(run())
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tables():
+    models.Base.metadata.create_all(bind=database.engine)
+
+
+def test_upsert_accumulates():
+    diseases, buckets = apply_twice(scan_rows("Apple_Scab", "Apple_Scab", "Apple_Healthy"))
+    assert diseases == [("Apple_Healthy", 2, 160.0), ("Apple_Scab", 4, 320.0)]
+    assert buckets == [("day", "Apple_Healthy", 2), ("day", "Apple_Scab", 4),
+                       ("hour", "Apple_Healthy", 2), ("hour", "Apple_Scab", 4)]
+
+
+def test_fallback_matches_upsert(monkeypatch):
+    expected = apply_twice(scan_rows("Apple_Scab", "Apple_Scab", "Apple_Healthy"))
+    # Dialects without ON CONFLICT take the UPDATE-then-INSERT path
+    monkeypatch.setattr(rollups, "UPSERT_INSERTS", {})
+    assert apply_twice(scan_rows("Apple_Scab", "Apple_Scab", "Apple_Healthy")) == expected
+
+
+def test_upsert_rows_in_key_order():
+    # Same lock order for every flush, whatever order the scans arrived in
+    stmt = rollups.rollup_upsert("postgresql", models.DiseaseRollup, rollups.disease_values(
+        scan_rows("Tomato_Blight", "Apple_Scab", "Corn_Rust")))
+    sql = str(stmt.compile(compile_kwargs={"literal_binds": True}))
+    assert sql.index("'Apple_Scab'") < sql.index("'Corn_Rust'") < sql.index("'Tomato_Blight'")
@@ -0,0 +1,258 @@
+"""
+Distributed CPU Training
+Data-parallel training across N local processes with torch.distributed (gloo) and
+DistributedDataParallel: each process trains on its own shard of the dataset with its
+own share of the cores, and gradients are averaged every step
+
+Usage:
+    python train_distributed.py --procs 4                  # train like train_model.py, rank 0 saves
+    python train_distributed.py --scaling 1,2,4 --synthetic 256 --steps 20 --scratch
+                                                            # samples/sec vs process count
+"""
+
+import argparse
+import json
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, DistributedSampler, Subset
+
+import train_model as tm
+
+
+class SyntheticDataset(Dataset):
+    """Random 224x224 images with fixed labels, for benchmarks without the real dataset"""
+
+    def __init__(self, size, num_classes, seed=0):
+        self.size = size
+        self.num_classes = num_classes
+        self.seed = seed
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(self.seed * 1_000_003 + idx)
+        image = torch.randn(3, 224, 224, generator=generator)
+        return image, idx % self.num_classes
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def threads_per_rank(world_size):
+    """Split the host's cores evenly between ranks"""
+    return max(1, (os.cpu_count() or 1) // world_size)
+
+
+def build_model(num_classes, scratch):
+    weights = None if scratch else tm.models.ResNet18_Weights.DEFAULT
+    model = tm.models.resnet18(weights=weights)
+    model.fc = nn.Linear(model.fc.in_features, num_classes)
+    return model
+
+
+def rank0_first(rank, fn):
+    """Run fn on rank 0 before the others, so the sample index, pack or weights download happen once"""
+    if rank == 0:
+        result = fn()
+    dist.barrier()
+    if rank != 0:
+        result = fn()
+    return result
+
+
+def load_datasets(rank, args):
+    if args.synthetic:
+        num_classes = len(tm.CLASS_NAMES)
+        return SyntheticDataset(args.synthetic, num_classes), SyntheticDataset(max(1, args.synthetic // 4), num_classes, seed=1)
+    return rank0_first(rank, tm.build_datasets)
+
+
+def train(rank, world_size, args):
+    """Returns global training samples/sec of the last epoch"""
+    train_dataset, test_dataset = load_datasets(rank, args)
+    # Unpadded, disjoint validation shards so the reduced accuracy counts every sample once
+    test_shard = Subset(test_dataset, range(rank, len(test_dataset), world_size))
+
+    sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=0)
+    train_loader = tm.make_loader(train_dataset, shuffle=False, batch_size=args.batch_size,
+                                  sampler=sampler, num_workers=args.workers)
+    test_loader = tm.make_loader(test_shard, shuffle=False, batch_size=args.batch_size, num_workers=args.workers)
+
+    num_classes = len(tm.CLASS_NAMES)
+    model = rank0_first(rank, lambda: build_model(num_classes, args.scratch))
+    # DDP broadcasts rank 0's parameters, so every rank starts from the same weights
+    model = DistributedDataParallel(model)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=3, gamma=0.1)
+
+    best_acc = 0.0
+    throughput = 0.0
+    for epoch in range(args.epochs):
+        sampler.set_epoch(epoch)
+        model.train()
+        seen = 0
+        start = None
+
+        for step, (images, labels) in enumerate(train_loader):
+            if args.steps and step >= args.steps + args.warmup:
+                break
+            # The first steps pay for allocator and gloo warm-up; leave them out of the timing
+            if step == args.warmup:
+                start = time.perf_counter()
+
+            optimizer.zero_grad()
+            loss = criterion(model(images), labels)
+            loss.backward()
+            optimizer.step()
+
+            if start is not None:
+                seen += labels.size(0)
+
+        if start is None:
+            if rank == 0:
+                print(f"⚠️ Epoch [{epoch+1}/{args.epochs}] had no timed steps - use more data or a lower --warmup")
+            elapsed = 0.0
+        else:
+            elapsed = time.perf_counter() - start
+        # Global throughput: every rank's samples over the slowest rank's time
+        totals = torch.tensor([seen], dtype=torch.float64)
+        slowest = torch.tensor([elapsed], dtype=torch.float64)
+        dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+        dist.all_reduce(slowest, op=dist.ReduceOp.MAX)
+        throughput = totals.item() / slowest.item() if slowest.item() > 0 else 0.0
+        scheduler.step()
+
+        if args.benchmark:
+            if rank == 0:
+                print(f"[{world_size} procs] Epoch [{epoch+1}/{args.epochs}] - {throughput:.1f} samples/s")
+            continue
+
+        model.eval()
+        counts = torch.zeros(2, dtype=torch.float64)
+        with torch.no_grad():
+            for images, labels in test_loader:
+                _, predicted = model(images).max(1)
+                counts[0] += predicted.eq(labels).sum().item()
+                counts[1] += labels.size(0)
+        dist.all_reduce(counts, op=dist.ReduceOp.SUM)
+        val_acc = 100. * counts[0].item() / max(1, counts[1].item())
+
+        if rank == 0:
+            print(f"\nEpoch [{epoch+1}/{args.epochs}] - {throughput:.1f} samples/s, "
+                  f"Loss: {loss.item():.4f}, Validation Accuracy: {val_acc:.2f}%\n")
+            if val_acc > best_acc:
+                best_acc = val_acc
+                torch.save({
+                    'model_state_dict': model.module.state_dict(),
+                    'class_names': tm.CLASS_NAMES,
+                    'num_classes': num_classes,
+                }, args.output)
+                print(f"Saved best model with accuracy: {best_acc:.2f}%")
+
+    if rank == 0 and not args.benchmark:
+        tm.save_classes(args.classes_output)
+        print(f"\n✅ Distributed training complete!")
+        print(f"   Model saved to: {args.output}")
+        print(f"   Classes saved to: {args.classes_output}")
+        print(f"   Best accuracy: {best_acc:.2f}%")
+    return throughput
+
+
+def run(rank, world_size, port, args, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(args.threads or threads_per_rank(world_size))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        throughput = train(rank, world_size, args)
+        if rank == 0:
+            results.put(throughput)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(world_size, args):
+    """Train on world_size local processes; returns rank 0's samples/sec"""
+    ctx = mp.get_context("spawn")
+    results = ctx.SimpleQueue()
+    mp.spawn(run, args=(world_size, free_port(), args, results), nprocs=world_size, join=True)
+    return results.get()
+
+
+def scaling_report(proc_counts, args):
+    args.benchmark = True
+    rows = []
+    for procs in proc_counts:
+        throughput = launch(procs, args)
+        rows.append({
+            "procs": procs,
+            "threads_per_proc": args.threads or threads_per_rank(procs),
+            "samples_per_sec": round(throughput, 2),
+        })
+
+    base = rows[0]["samples_per_sec"] / rows[0]["procs"] or 1.0
+    print(f"\n{'procs':>5} {'threads':>7} {'samples/s':>10} {'speedup':>8} {'efficiency':>10}")
+    for row in rows:
+        row["speedup"] = round(row["samples_per_sec"] / (rows[0]["samples_per_sec"] or 1.0), 2)
+        # Per-process throughput relative to the smallest run
+        row["efficiency"] = round(row["samples_per_sec"] / row["procs"] / base, 2)
+        print(f"{row['procs']:>5} {row['threads_per_proc']:>7} {row['samples_per_sec']:>10.1f} "
+              f"{row['speedup']:>7.2f}x {row['efficiency']:>10.2f}")
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Data-parallel CPU training with torch.distributed (gloo)")
+    parser.add_argument("--procs", type=int, default=2, help="Training processes")
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads per process (default: cores / procs)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="DataLoader workers per process (default: LOADER_WORKERS / procs)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Per-process batch size")
+    parser.add_argument("--epochs", type=int, default=None, help="Epochs (default: 10, or 1 with --scaling)")
+    parser.add_argument("--steps", type=int, default=0, help="Cap timed steps per epoch (0 = full epoch)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed steps at the start of each epoch")
+    parser.add_argument("--synthetic", type=int, default=0, help="Train on N random images instead of the dataset")
+    parser.add_argument("--scratch", action="store_true", help="Start from random weights instead of ImageNet")
+    parser.add_argument("--scaling", help="Comma-separated process counts to benchmark, e.g. 1,2,4")
+    parser.add_argument("--report", help="Write the scaling results to this JSON file")
+    parser.add_argument("--output", default=tm.MODEL_OUTPUT, help="Checkpoint path")
+    parser.add_argument("--classes-output", help="classes.json path (default: next to --output)")
+    args = parser.parse_args()
+    if args.classes_output is None:
+        args.classes_output = os.path.join(os.path.dirname(os.path.abspath(args.output)), "classes.json")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.benchmark = False
+
+    if args.scaling:
+        proc_counts = [int(p) for p in args.scaling.split(",")]
+        if args.workers is None:
+            args.workers = 0 if args.synthetic else max(0, tm.LOADER_WORKERS // max(proc_counts))
+        args.epochs = args.epochs or 1
+        rows = scaling_report(proc_counts, args)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump({"cpu_count": os.cpu_count(), "batch_size": args.batch_size, "results": rows}, f, indent=2)
+            print(f"Report saved to {args.report}")
+    else:
+        args.epochs = args.epochs or 10
+        if args.workers is None:
+            args.workers = max(0, tm.LOADER_WORKERS // args.procs)
+        launch(args.procs, args)
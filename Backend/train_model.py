@@ -11,7 +11,11 @@ from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, models
 from PIL import Image
 import json
-from pathlib import Path
+import time
+
+from dataset_index import indexed_samples
+from dataset_pack import PackedPlantDiseaseDataset, pack_samples
+from feature_cache import cache_features
 
 # Dataset paths - Using BOTH folders for maximum data
 TRAIN_DIRS = [
@@ -25,6 +29,27 @@ TEST_DIRS = [
 MODEL_OUTPUT = r"C:\Users\adith\OneDrive\Desktop\plant-disease\Backend\plant_disease_model.pth"
 CLASSES_OUTPUT = r"C:\Users\adith\OneDrive\Desktop\plant-disease\Backend\classes.json"
 
+# Decode + resize every image once into memmapped arrays (see dataset_pack.py);
+# repacking only processes images added or changed since the last run
+USE_PACKED_DATASET = os.getenv("USE_PACKED_DATASET", "0") == "1"
+PACKED_DATA_DIR = os.getenv("PACKED_DATA_DIR", os.path.join(os.path.dirname(MODEL_OUTPUT), "packed_data"))
+
+# "finetune" trains the whole network; "head" trains only model.fc on cached backbone features
+TRAIN_MODE = os.getenv("TRAIN_MODE", "finetune")
+FEATURE_CACHE_DIR = os.getenv("FEATURE_CACHE_DIR", os.path.join(os.path.dirname(MODEL_OUTPUT), "feature_cache"))
+HEAD_EPOCHS = int(os.getenv("HEAD_EPOCHS", "100"))
+HEAD_BATCH_SIZE = int(os.getenv("HEAD_BATCH_SIZE", "4096"))
+
+# Cached (image_path, class_id) list, rebuilt per directory when it changes (see dataset_index.py)
+SAMPLE_INDEX_PATH = os.getenv("SAMPLE_INDEX_PATH", os.path.join(os.path.dirname(MODEL_OUTPUT), "sample_index.json"))
+
+# DataLoader settings: decode/augment in worker processes while the main process trains
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", str(min(8, os.cpu_count() or 1))))
+LOADER_PREFETCH = int(os.getenv("LOADER_PREFETCH", "4"))  # batches queued per worker
+LOADER_PERSISTENT = os.getenv("LOADER_PERSISTENT", "1") == "1"  # keep workers alive across epochs
+# Page-locked batches make host->GPU copies async; pointless without a GPU
+PIN_MEMORY = os.getenv("PIN_MEMORY", "1" if torch.cuda.is_available() else "0") == "1"
+
 # Standard PlantVillage disease classes (30 classes based on your dataset)
 CLASS_NAMES = {
     0: "Apple_Scab",
@@ -94,31 +119,29 @@ REMEDIES = {
 }
 
 
+def find_samples(data_dirs):
+    """(image_path, class_id) for every jpg with a YOLO label file, across all directories"""
+    return [
+        (img_path, class_id)
+        for img_path, class_id in indexed_samples(data_dirs, SAMPLE_INDEX_PATH)
+        if class_id in CLASS_NAMES
+    ]
+
+
+def make_loader(dataset, shuffle, batch_size=32, sampler=None, num_workers=LOADER_WORKERS):
+    options = {}
+    if num_workers > 0:
+        options = {"persistent_workers": LOADER_PERSISTENT, "prefetch_factor": LOADER_PREFETCH}
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler,
+                      num_workers=num_workers, pin_memory=PIN_MEMORY, **options)
+
+
 class PlantDiseaseDataset(Dataset):
     """Custom dataset that reads YOLO format and extracts class labels from multiple directories"""
     
     def __init__(self, data_dirs, transform=None):
         self.transform = transform
-        self.samples = []
-        
-        # Load from all directories
-        for data_dir in data_dirs:
-            data_path = Path(data_dir)
-            if not data_path.exists():
-                print(f"Warning: Directory not found: {data_dir}")
-                continue
-                
-            # Find all jpg files and their corresponding txt files
-            for img_path in data_path.glob("*.jpg"):
-                txt_path = img_path.with_suffix(".txt")
-                if txt_path.exists():
-                    # Read class ID from txt file (first number)
-                    with open(txt_path, 'r') as f:
-                        content = f.read().strip()
-                        if content:
-                            class_id = int(content.split()[0])
-                            if class_id in CLASS_NAMES:
-                                self.samples.append((str(img_path), class_id))
+        self.samples = find_samples(data_dirs)
         
         print(f"Loaded {len(self.samples)} total samples from {len(data_dirs)} directories")
     
@@ -135,10 +158,40 @@ class PlantDiseaseDataset(Dataset):
         return image, class_id
 
 
-def train_model():
-    # Check for GPU
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
+def load_packed_datasets():
+    """Pack new/changed images, then read both splits from the memmapped arrays"""
+    # Packed samples are already 224x224 uint8 tensors: no decode or Resize per epoch
+    packed_train_transform = transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(10),
+        transforms.ConvertImageDtype(torch.float),
+        transforms.ColorJitter(brightness=0.2, contrast=0.2),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+    
+    packed_test_transform = transforms.Compose([
+        transforms.ConvertImageDtype(torch.float),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+    
+    train_pack = os.path.join(PACKED_DATA_DIR, "train")
+    test_pack = os.path.join(PACKED_DATA_DIR, "test")
+    
+    print("Packing training data...")
+    pack_samples(find_samples(TRAIN_DIRS), train_pack)
+    print("Packing test data...")
+    pack_samples(find_samples(TEST_DIRS), test_pack)
+    
+    return (
+        PackedPlantDiseaseDataset(train_pack, transform=packed_train_transform),
+        PackedPlantDiseaseDataset(test_pack, transform=packed_test_transform),
+    )
+
+
+def build_datasets():
+    """(train_dataset, test_dataset), from the packed arrays or straight from the image folders"""
+    if USE_PACKED_DATASET:
+        return load_packed_datasets()
     
     # Data transforms
     train_transform = transforms.Compose([
@@ -162,9 +215,101 @@ def train_model():
     
     print("Loading test data from all directories...")
     test_dataset = PlantDiseaseDataset(TEST_DIRS, transform=test_transform)
+    return train_dataset, test_dataset
+
+
+def save_classes(path=CLASSES_OUTPUT):
+    classes_data = {
+        'class_names': CLASS_NAMES,
+        'remedies': REMEDIES
+    }
+    with open(path, 'w') as f:
+        json.dump(classes_data, f, indent=2)
+
+
+def train_head():
+    """Train only the classifier head on frozen, cached ResNet18 features"""
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
     
-    train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True, num_workers=0)
-    test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False, num_workers=0)
+    # Features are extracted once, so they use the deterministic eval transform (no augmentation)
+    feature_transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+    
+    weights = models.ResNet18_Weights.DEFAULT
+    model = models.resnet18(weights=weights)
+    feature_dim = model.fc.in_features
+    model.fc = nn.Identity()
+    backbone_id = f"resnet18/{weights.name}"
+    
+    print("Caching training features...")
+    train_x, train_y = cache_features(find_samples(TRAIN_DIRS), FEATURE_CACHE_DIR, model, backbone_id,
+                                      feature_dim, feature_transform, device, num_workers=LOADER_WORKERS)
+    print("Caching test features...")
+    test_x, test_y = cache_features(find_samples(TEST_DIRS), FEATURE_CACHE_DIR, model, backbone_id,
+                                    feature_dim, feature_transform, device, num_workers=LOADER_WORKERS)
+    train_x, train_y = train_x.to(device), train_y.to(device)
+    test_x, test_y = test_x.to(device), test_y.to(device)
+    
+    num_classes = len(CLASS_NAMES)
+    head = nn.Linear(feature_dim, num_classes).to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=0.001, weight_decay=1e-4)
+    
+    best_acc = 0.0
+    best_state = None
+    start = time.perf_counter()
+    print(f"\nTraining head on {len(train_x)} cached features for {HEAD_EPOCHS} epochs...")
+    
+    for epoch in range(HEAD_EPOCHS):
+        head.train()
+        order = torch.randperm(len(train_x), device=device)
+        for i in range(0, len(order), HEAD_BATCH_SIZE):
+            batch = order[i:i + HEAD_BATCH_SIZE]
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[batch]), train_y[batch])
+            loss.backward()
+            optimizer.step()
+        
+        head.eval()
+        with torch.no_grad():
+            val_acc = 100. * (head(test_x).argmax(1) == test_y).float().mean().item() if len(test_x) else 0.0
+        if best_state is None or val_acc > best_acc:
+            best_acc = val_acc
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+        if (epoch + 1) % 10 == 0:
+            print(f"Epoch [{epoch+1}/{HEAD_EPOCHS}], Loss: {loss.item():.4f}, Validation Accuracy: {val_acc:.2f}%")
+    
+    # Put the best head back on the backbone: same checkpoint format as train_model()
+    model.fc = nn.Linear(feature_dim, num_classes)
+    model.fc.load_state_dict(best_state)
+    torch.save({
+        'model_state_dict': model.cpu().state_dict(),
+        'class_names': CLASS_NAMES,
+        'num_classes': num_classes,
+    }, MODEL_OUTPUT)
+    save_classes()
+    
+    print(f"\n✅ Head training complete in {time.perf_counter() - start:.1f}s!")
+    print(f"   Model saved to: {MODEL_OUTPUT}")
+    print(f"   Classes saved to: {CLASSES_OUTPUT}")
+    print(f"   Best accuracy: {best_acc:.2f}%")
+
+
+def train_model():
+    # Check for GPU
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+    
+    train_dataset, test_dataset = build_datasets()
+    
+    train_loader = make_loader(train_dataset, shuffle=True)
+    test_loader = make_loader(test_dataset, shuffle=False)
+    print(f"DataLoader: {LOADER_WORKERS} workers, prefetch {LOADER_PREFETCH}, "
+          f"persistent {LOADER_PERSISTENT}, pin_memory {PIN_MEMORY}")
     
     # Create model (using pretrained ResNet18 for speed)
     print("Creating model...")
@@ -189,9 +334,17 @@ def train_model():
         running_loss = 0.0
         correct = 0
         total = 0
+        # Time blocked waiting on the loader vs time spent in forward/backward
+        data_wait = 0.0
+        compute = 0.0
+        epoch_start = time.perf_counter()
+        batch_start = epoch_start
         
         for batch_idx, (images, labels) in enumerate(train_loader):
-            images, labels = images.to(device), labels.to(device)
+            step_start = time.perf_counter()
+            data_wait += step_start - batch_start
+            images = images.to(device, non_blocking=PIN_MEMORY)
+            labels = labels.to(device, non_blocking=PIN_MEMORY)
             
             optimizer.zero_grad()
             outputs = model(images)
@@ -207,6 +360,15 @@ def train_model():
             if (batch_idx + 1) % 20 == 0:
                 print(f"Epoch [{epoch+1}/{num_epochs}], Batch [{batch_idx+1}/{len(train_loader)}], "
                       f"Loss: {loss.item():.4f}, Acc: {100.*correct/total:.2f}%")
+            
+            # loss.item() above already waited for the device, so this covers the whole step
+            batch_start = time.perf_counter()
+            compute += batch_start - step_start
+        
+        epoch_time = time.perf_counter() - epoch_start
+        print(f"Epoch [{epoch+1}/{num_epochs}] - {total / epoch_time:.1f} samples/s, "
+              f"data wait {data_wait:.1f}s ({100. * data_wait / epoch_time:.0f}%), "
+              f"compute {compute:.1f}s ({100. * compute / epoch_time:.0f}%)")
         
         scheduler.step()
         
@@ -217,7 +379,8 @@ def train_model():
         
         with torch.no_grad():
             for images, labels in test_loader:
-                images, labels = images.to(device), labels.to(device)
+                images = images.to(device, non_blocking=PIN_MEMORY)
+                labels = labels.to(device, non_blocking=PIN_MEMORY)
                 outputs = model(images)
                 _, predicted = outputs.max(1)
                 val_total += labels.size(0)
@@ -237,12 +400,7 @@ def train_model():
             print(f"Saved best model with accuracy: {best_acc:.2f}%")
     
     # Save class names and remedies
-    classes_data = {
-        'class_names': CLASS_NAMES,
-        'remedies': REMEDIES
-    }
-    with open(CLASSES_OUTPUT, 'w') as f:
-        json.dump(classes_data, f, indent=2)
+    save_classes()
     
     print(f"\n✅ Training complete!")
     print(f"   Model saved to: {MODEL_OUTPUT}")
@@ -251,4 +409,7 @@ def train_model():
 
 
 if __name__ == "__main__":
-    train_model()
+    if TRAIN_MODE == "head":
+        train_head()
+    else:
+        train_model()
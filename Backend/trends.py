@@ -0,0 +1,110 @@
+"""
+Disease Trend Queries
+Time-bucketed scan counts per disease for /analytics/trends, read from the hourly and
+daily rows of disease_trend_rollups; weeks and months are summed from the daily rows
+"""
+
+import datetime
+import os
+from collections import defaultdict
+
+from sqlalchemy import select
+
+import models
+
+BUCKETS = ("hour", "day", "week", "month")
+# Granularity kept in disease_trend_rollups for each bucket size
+STORED_GRANULARITY = {"hour": "hour", "day": "day", "week": "day", "month": "day"}
+STORED_GRANULARITIES = ("hour", "day")
+# Range used when the request gives no start
+DEFAULT_SPAN = {
+    "hour": datetime.timedelta(hours=48),
+    "day": datetime.timedelta(days=30),
+    "week": datetime.timedelta(weeks=26),
+    "month": datetime.timedelta(days=365),
+}
+TRENDS_MAX_BUCKETS = int(os.getenv("TRENDS_MAX_BUCKETS", "2000"))
+
+
+class InvalidTrendQuery(ValueError):
+    pass
+
+
+def bucket_start(timestamp, bucket):
+    """Start of the UTC bucket holding timestamp; weeks start on Monday"""
+    if bucket == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    raise InvalidTrendQuery(f"Unknown bucket '{bucket}', expected one of {', '.join(BUCKETS)}")
+
+
+def next_bucket(start, bucket):
+    if bucket == "hour":
+        return start + datetime.timedelta(hours=1)
+    if bucket == "day":
+        return start + datetime.timedelta(days=1)
+    if bucket == "week":
+        return start + datetime.timedelta(weeks=1)
+    return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+
+
+async def query_trends(db, bucket="day", start=None, end=None, disease=None):
+    """Every bucket overlapping [start, end), oldest first, with per-disease counts (empty buckets included)"""
+    if bucket not in BUCKETS:
+        raise InvalidTrendQuery(f"Unknown bucket '{bucket}', expected one of {', '.join(BUCKETS)}")
+    end = models.naive_utc(end) or datetime.datetime.utcnow()
+    start = models.naive_utc(start) or end - DEFAULT_SPAN[bucket]
+    if start >= end:
+        raise InvalidTrendQuery("start must be before end")
+
+    starts = [bucket_start(start, bucket)]
+    while next_bucket(starts[-1], bucket) < end:
+        starts.append(next_bucket(starts[-1], bucket))
+        if len(starts) > TRENDS_MAX_BUCKETS:
+            raise InvalidTrendQuery(f"Range spans more than {TRENDS_MAX_BUCKETS} {bucket} buckets")
+
+    trend = models.DiseaseTrendRollup
+    query = select(trend.bucket_start, trend.disease_name, trend.scan_count, trend.confidence_sum).where(
+        trend.granularity == STORED_GRANULARITY[bucket],
+        trend.bucket_start >= starts[0],
+        trend.bucket_start < end,
+    )
+    if disease is not None:
+        query = query.where(trend.disease_name == disease)
+    result = await db.execute(query)
+
+    # Roll the stored hour/day rows up into the requested bucket size
+    totals = defaultdict(lambda: [0, 0.0])
+    for row in result:
+        total = totals[(bucket_start(row.bucket_start, bucket), row.disease_name)]
+        total[0] += row.scan_count
+        total[1] += row.confidence_sum
+
+    per_bucket = defaultdict(list)
+    for (start_of_bucket, disease_name), (count, confidence_sum) in sorted(totals.items()):
+        if count > 0:
+            per_bucket[start_of_bucket].append({
+                "disease_name": disease_name,
+                "count": count,
+                "average_confidence": round(confidence_sum / count, 2),
+            })
+
+    return {
+        "bucket": bucket,
+        "start": starts[0],
+        "end": next_bucket(starts[-1], bucket),
+        "buckets": [
+            {
+                "bucket_start": start_of_bucket,
+                "total": sum(point["count"] for point in per_bucket.get(start_of_bucket, [])),
+                "diseases": per_bucket.get(start_of_bucket, []),
+            }
+            for start_of_bucket in starts
+        ],
+    }
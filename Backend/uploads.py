@@ -0,0 +1,205 @@
+"""
+Upload Ingestion Limits
+Caps upload size per route, decoded pixel count, and the upload bytes held by all
+in-flight requests, so a burst of large uploads can't push the process out of memory
+
+Request bodies are streamed by Starlette's multipart parser into spooled temporary files
+(in memory up to 1MB, then on disk); handlers hash and decode from those files instead of
+reading each upload into one bytes object.
+"""
+
+import asyncio
+import io
+import os
+
+from fastapi import HTTPException
+from PIL import Image
+from starlette.responses import JSONResponse
+
+import executor
+
+MB = 1024 * 1024
+
+# Largest accepted /predict request body
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "20")) * MB)
+# Largest accepted /predict/batch request body, and the most bytes its archives may expand to
+MAX_BATCH_UPLOAD_BYTES = int(float(os.getenv("MAX_BATCH_UPLOAD_MB", "200")) * MB)
+# Decompression-bomb guard, checked from the image header before any pixels are decoded
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+# Upload bytes all in-flight requests in this process may hold at once
+UPLOAD_INFLIGHT_BYTES = int(float(os.getenv("UPLOAD_INFLIGHT_MB", "256")) * MB)
+# Seconds a request waits for upload budget before it is answered with 503
+UPLOAD_BUDGET_TIMEOUT = float(os.getenv("UPLOAD_BUDGET_TIMEOUT", "10"))
+
+ROUTE_LIMITS = {
+    "/predict": MAX_UPLOAD_BYTES,
+    "/predict/batch": MAX_BATCH_UPLOAD_BYTES,
+}
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload (or what it expands to) is over its limit; the API answers 413"""
+
+
+def _too_large(what, nbytes, limit):
+    return f"{what} is {nbytes / MB:.1f} MB, limit is {limit / MB:.1f} MB"
+
+
+# -------------------- READING UPLOADS --------------------
+
+def as_stream(source):
+    """Binary stream positioned at the start, for upload bytes or a spooled upload file"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def check_pixels(image, max_pixels=MAX_IMAGE_PIXELS):
+    """Refuse images whose header declares more than max_pixels; nothing is decoded yet"""
+    pixels = image.width * image.height
+    if max_pixels and pixels > max_pixels:
+        raise Image.DecompressionBombError(
+            f"Image is {image.width}x{image.height} ({pixels / 1e6:.1f} MP), limit is {max_pixels / 1e6:.1f} MP"
+        )
+    return image
+
+
+def open_image(source, max_pixels=MAX_IMAGE_PIXELS):
+    """Lazily opened PIL image; only the header has been read when this returns"""
+    return check_pixels(Image.open(as_stream(source)), max_pixels)
+
+
+# -------------------- IN-FLIGHT BUDGET --------------------
+
+class ByteBudget:
+    """Counting semaphore over bytes; acquire() waits for room and sheds load after a timeout"""
+
+    def __init__(self, limit, timeout=UPLOAD_BUDGET_TIMEOUT):
+        self.limit = max(1, limit)
+        self.timeout = timeout
+        self.in_use = 0
+        self.peak = 0
+        self.waiting = 0
+        self.rejected_busy = 0
+        self.rejected_too_large = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, nbytes):
+        """Reserve nbytes (capped at the whole budget); returns the amount to release later"""
+        nbytes = min(max(0, nbytes), self.limit)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(self.timeout):
+                    await self._condition.wait_for(lambda: self.in_use + nbytes <= self.limit)
+            except TimeoutError:
+                self.rejected_busy += 1
+                raise executor.ServerBusy("upload")
+            finally:
+                self.waiting -= 1
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+        return nbytes
+
+    async def release(self, nbytes):
+        if nbytes <= 0:
+            return
+        async with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "limit_mb": round(self.limit / MB, 1),
+            "in_use_mb": round(self.in_use / MB, 1),
+            "peak_mb": round(self.peak / MB, 1),
+            "waiting": self.waiting,
+            "rejected_busy": self.rejected_busy,
+            "rejected_too_large": self.rejected_too_large,
+        }
+
+
+upload_budget = ByteBudget(UPLOAD_INFLIGHT_BYTES)
+
+
+async def reserve(request, nbytes):
+    """Charge extra bytes (e.g. extracted archive members) to the request's budget reservation"""
+    # Set up by UploadLimitMiddleware, which releases everything when the response ends
+    reservations = request.scope["upload_reservations"]
+    held = sum(reservations)
+    if held + nbytes > upload_budget.limit:
+        # Waiting can't help: the request would need room its own reservation is taking up
+        upload_budget.rejected_too_large += 1
+        raise UploadTooLarge(f"Upload and extracted archives need {(held + nbytes) / MB:.1f} MB, "
+                             f"in-flight upload budget is {upload_budget.limit / MB:.1f} MB")
+    reservations.append(await upload_budget.acquire(nbytes))
+
+
+# -------------------- MIDDLEWARE --------------------
+
+class UploadLimitMiddleware:
+    """Pure ASGI middleware: 413 before reading an oversize body, and an in-flight byte budget
+
+    The declared Content-Length (or the route limit for chunked bodies) is reserved from
+    upload_budget for the whole request, and released when the response is finished.
+    """
+
+    def __init__(self, app, limits=None, budget=None):
+        self.app = app
+        self.limits = ROUTE_LIMITS if limits is None else limits
+        self.budget = upload_budget if budget is None else budget
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+                break
+
+        if content_length is not None and content_length > limit:
+            # Refused from the headers alone: the body is never read
+            self.budget.rejected_too_large += 1
+            await self._reject(scope, receive, send, 413, _too_large("Upload", content_length, limit))
+            return
+
+        try:
+            reservation = await self.budget.acquire(content_length if content_length is not None else limit)
+        except executor.ServerBusy as e:
+            await self._reject(scope, receive, send, 503, f"Server busy: {e}",
+                               {"Retry-After": str(e.retry_after)})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Chunked body, or one that outgrew its Content-Length; FastAPI re-raises
+                    # HTTPExceptions from body parsing as they are
+                    self.budget.rejected_too_large += 1
+                    raise HTTPException(status_code=413, detail=_too_large("Upload", received, limit))
+            return message
+
+        scope["upload_reservations"] = [reservation]
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            for reserved in scope["upload_reservations"]:
+                await self.budget.release(reserved)
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code, detail, headers=None):
+        response = JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+        await response(scope, receive, send)